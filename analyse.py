@@ -1,16 +1,66 @@
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from difflib import SequenceMatcher
+import hashlib
+import inspect
+import os
+from pathlib import Path
+import shutil
 import sys
 
-import iso3166
-from joblib import Memory
-from matplotlib import cm
-import matplotlib.pyplot as plt
-import numpy as np
-from PIL import Image
-
 from dataset import Database, Events
+import profiling
+
+
+CACHE_SIZE = 256 * 1024 * 1024
+
+
+class ResultCache:
+    def __init__(self, path='cache/analyse', max_size=CACHE_SIZE):
+        self.path = Path(path)
+        self.max_size = max_size
+
+    def entry(self, name, key):
+        return self.path / '{}-{}.png'.format(name, key)
+
+    def get(self, name, key, output):
+        entry = self.entry(name, key)
+        if not entry.exists():
+            return False
+
+        os.utime(str(entry), None)  # mark as recently used
+        shutil.copyfile(str(entry), str(output))
+        return True
+
+    def put(self, name, key, output):
+        if not self.path.exists():
+            self.path.mkdir(parents=True)
+
+        shutil.copyfile(str(output), str(self.entry(name, key)))
+        self.evict()
+
+    def evict(self):
+        entries = sorted(self.path.glob('*.png'),
+                         key=lambda path: path.stat().st_mtime)
+        size = sum(path.stat().st_size for path in entries)
+
+        # always keep the newest entry, even if it is over the limit
+        for path in entries[:-1]:
+            if size <= self.max_size:
+                break
 
-memory = Memory('cache/analyse', verbose=0)
+            size -= path.stat().st_size
+            path.unlink()
+
+
+def get_pyplot():
+    # workers have no display, so select a non-interactive backend before
+    # pyplot is first imported
+    import matplotlib
+    matplotlib.use('Agg')
+
+    import matplotlib.pyplot as plt
+    return plt
 
 
 MATCHING_COMPANIES = {
@@ -80,9 +130,10 @@ MATCHING_COMPANIES = {
 }
 
 
-def companies():
-    database = Database()
-    data = database.get_company_distribution()
+def companies(data):
+    import numpy as np
+
+    plt = get_pyplot()
 
     def find_similarities():
         names = list(data.keys())
@@ -118,9 +169,11 @@ def companies():
     plt.savefig('results/companies.png')
 
 
-def countries():
-    database = Database()
-    data = database.get_country_distribution()
+def countries(data):
+    import iso3166
+    import numpy as np
+
+    plt = get_pyplot()
 
     for code in list(data.keys()):
         try:
@@ -143,9 +196,10 @@ def countries():
     plt.savefig('results/countries.png')
 
 
-def genders():
-    database = Database()
-    data = database.get_gender_distribution()
+def genders(data):
+    import numpy as np
+
+    plt = get_pyplot()
 
     mappings = [
         ('Male', 'M'),
@@ -169,15 +223,16 @@ def genders():
     plt.savefig('results/genders.png')
 
 
-def world_map():
+def world_map(points):
+    from PIL import Image
+
     width = 3422
     height = 1731
 
     image = Image.open('resources/world-map.png')
     point = Image.open('resources/point.png')
 
-    database = Database()
-    for lat, lon in database.get_location_points():
+    for lat, lon in points:
         lat = float(lat)
         lon = float(lon)
 
@@ -189,8 +244,17 @@ def world_map():
     image.save('results/world_map.png')
 
 
-def growth():
-    events = Events()
+def world_map_tiles(points):
+    from tiles import write_pyramid
+
+    write_pyramid(points)
+
+
+def growth(event_types, monthly_counts):
+    from matplotlib import cm
+    import numpy as np
+
+    plt = get_pyplot()
 
     """
     p1 = plt.bar(ind, menMeans, width, color='r', yerr=menStd)
@@ -206,19 +270,13 @@ plt.legend((p1[0], p2[0]), ('Men', 'Women'))
 plt.show()
 """
 
-    n = 12 * 6
+    n = len(monthly_counts)
 
-    types = list(sorted(events.types))
+    data = {s: [] for s in event_types}
 
-    data = {s: [] for s in types}
-
-    for year in range(2011, 2017):
-        for month in range(1, 13):
-            print(year, month)
-            counts = events.count_types(year, month)
-            print(counts)
-            for key in data.keys():
-                data[key].append(counts[key])
+    for counts in monthly_counts.values():
+        for key in data.keys():
+            data[key].append(counts[key])
 
     ind = np.arange(n)
 
@@ -234,7 +292,219 @@ plt.show()
     plt.savefig('results/growth.png')
 
 
+def load_location_points(database):
+    return list(database.get_location_points())
+
+
+def load_event_types():
+    events = Events()
+    return list(sorted(events.types))
+
+
+def load_monthly_event_types():
+    events = Events()
+
+    monthly_counts = OrderedDict()
+
+    for year in range(2011, 2017):
+        for month in range(1, 13):
+            print(year, month)
+            counts = events.count_types(year, month)
+            print(counts)
+            monthly_counts[year, month] = counts
+
+    return monthly_counts
+
+
+DATABASE_DATASETS = {
+    'company_distribution': Database.get_company_distribution,
+    'country_distribution': Database.get_country_distribution,
+    'gender_distribution': Database.get_gender_distribution,
+    'location_points': load_location_points,
+}
+
+ARCHIVE_DATASETS = {
+    'event_types': load_event_types,
+    'monthly_event_types': load_monthly_event_types,
+}
+
+ANALYSES = {
+    'companies': (companies, ['company_distribution']),
+    'countries': (countries, ['country_distribution']),
+    'genders': (genders, ['gender_distribution']),
+    'world_map': (world_map, ['location_points']),
+    'world_map_tiles': (world_map_tiles, ['location_points']),
+    'growth': (growth, ['event_types', 'monthly_event_types']),
+}
+
+# these keep their own record of what they last wrote
+UNCACHED_ANALYSES = {'world_map_tiles'}
+
+
+DATASET_TABLES = {
+    'company_distribution': 'users',
+    'country_distribution': 'users',
+    'gender_distribution': 'users',
+    'location_points': 'users',
+}
+
+
+def get_code_version(function):
+    parts = [inspect.getsource(function)]
+
+    # include module level constants, such as MATCHING_COMPANIES
+    for name in function.__code__.co_names:
+        value = function.__globals__.get(name)
+        if isinstance(value, (dict, list, tuple, str, int, float)):
+            parts.append(repr(value))
+
+    return '\n'.join(parts)
+
+
+def get_data_versions(datasets):
+    versions = {}
+    table_versions = {}
+
+    database = None
+    events = None
+
+    for dataset in datasets:
+        if dataset in ARCHIVE_DATASETS:
+            if events is None:
+                events = Events()
+            versions[dataset] = events.get_manifest_checksum()
+            continue
+
+        table = DATASET_TABLES[dataset]
+        if table not in table_versions:
+            if database is None:
+                database = Database()
+            table_versions[table] = database.get_table_version(table)
+        versions[dataset] = table_versions[table]
+
+    if database is not None:
+        database.close()
+
+    return versions
+
+
+def get_cache_key(name, versions):
+    function, datasets = ANALYSES[name]
+
+    # without a version for some of its data, a result can't be reused
+    if any(versions[dataset] is None for dataset in datasets):
+        return None
+
+    loaders = [ARCHIVE_DATASETS.get(d) or DATABASE_DATASETS[d]
+               for d in datasets]
+
+    key = hashlib.sha1()
+    key.update(get_code_version(function).encode('utf-8'))
+    for dataset, loader in zip(datasets, loaders):
+        key.update(get_code_version(loader).encode('utf-8'))
+        key.update(repr(versions[dataset]).encode('utf-8'))
+
+    return key.hexdigest()
+
+
+def get_output(name):
+    return Path('results') / '{}.png'.format(name)
+
+
+def init_worker(profiler):
+    profiling.active = profiler
+
+
+def load_dataset(name):
+    with profiling.stage('load-' + name):
+        if name in ARCHIVE_DATASETS:
+            return name, ARCHIVE_DATASETS[name]()
+
+        database = Database()
+        try:
+            return name, DATABASE_DATASETS[name](database)
+        finally:
+            database.close()
+
+
+def run_analysis(name, data):
+    function = ANALYSES[name][0]
+    with profiling.stage(name):
+        function(*data)
+    return name
+
+
+def get_datasets(names):
+    datasets = []
+    for name in names:
+        for dataset in ANALYSES[name][1]:
+            if dataset not in datasets:
+                datasets.append(dataset)
+    return datasets
+
+
+def run(names, processes=None, cache=None):
+    if cache is None:
+        cache = ResultCache()
+
+    # skip analyses whose code and data have not changed since last time
+    versions = get_data_versions(get_datasets(names))
+    keys = {name: get_cache_key(name, versions) for name in names}
+
+    stale = []
+    for name in names:
+        if name in UNCACHED_ANALYSES or keys[name] is None:
+            stale.append(name)
+        elif cache.get(name, keys[name], get_output(name)):
+            print('Cached:', name)
+        else:
+            stale.append(name)
+
+    names = stale
+    if not names:
+        return
+
+    datasets = get_datasets(names)
+
+    # a worker that dies raises BrokenProcessPool here, where a
+    # multiprocessing.Pool would keep replacing it and never return
+    executor = ProcessPoolExecutor(processes, initializer=init_worker,
+                                   initargs=(profiling.active,))
+
+    with executor:
+        # each dataset is loaded once, in its own worker with its own
+        # connection, and an analysis starts as soon as its data is ready
+        snapshot = {}
+        pending = list(names)
+        analyses = []
+
+        loads = [executor.submit(load_dataset, d) for d in datasets]
+        for future in as_completed(loads):
+            dataset, data = future.result()
+            print('Loaded:', dataset)
+            snapshot[dataset] = data
+
+            for name in list(pending):
+                needed = ANALYSES[name][1]
+                if all(dataset in snapshot for dataset in needed):
+                    print('Analysing:', name)
+                    data = [snapshot[d] for d in needed]
+                    analyses.append(executor.submit(run_analysis, name, data))
+                    pending.remove(name)
+
+        for future in analyses:
+            name = future.result()
+            if keys[name] is not None and name not in UNCACHED_ANALYSES:
+                cache.put(name, keys[name], get_output(name))
+            print('Finished:', name)
+
 if __name__ == '__main__':
-    for name in sys.argv[1:]:
-        print('Analysing:', name)
-        locals()[name]()
+    names = profiling.parse_args(sys.argv[1:], 'analyse')
+
+    unknown = [name for name in names if name not in ANALYSES]
+    if unknown:
+        print('Unknown analysis:', ', '.join(unknown))
+        print('Available analyses:', ', '.join(sorted(ANALYSES)))
+        sys.exit(1)
+
+    run(names)
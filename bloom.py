@@ -0,0 +1,118 @@
+import hashlib
+import json
+import math
+from pathlib import Path
+
+
+def get_hashes(item):
+    if isinstance(item, tuple):
+        item = '\0'.join(item)
+
+    digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+    h1 = int.from_bytes(digest[:8], 'little')
+    h2 = int.from_bytes(digest[8:], 'little') | 1
+    return h1, h2
+
+
+class BloomFilter:
+    def __init__(self, capacity, error_rate, bits=None, hashes=None,
+                 count=0, data=None):
+        self.capacity = capacity
+        self.error_rate = error_rate
+
+        if bits is None:
+            bits = int(-capacity * math.log(error_rate) / math.log(2) ** 2)
+            bits = max(8, bits)
+        if hashes is None:
+            hashes = max(1, round(bits / capacity * math.log(2)))
+
+        self.bits = bits
+        self.hashes = hashes
+        self.count = count
+        self.data = bytearray((bits + 7) // 8) if data is None else data
+
+    def positions(self, h1, h2):
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+    def contains(self, h1, h2):
+        data = self.data
+        for position in self.positions(h1, h2):
+            if not data[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def add(self, h1, h2):
+        data = self.data
+        for position in self.positions(h1, h2):
+            data[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    @property
+    def full(self):
+        return self.count >= self.capacity
+
+
+class ScalableBloomFilter:
+    # Almeida et al: each new filter is twice the size with a tighter error
+    # rate, so the compound error rate stays below error_rate
+    GROWTH = 2
+    TIGHTENING = 0.5
+
+    def __init__(self, error_rate=0.001, initial_capacity=1000000):
+        self.error_rate = error_rate
+        self.initial_capacity = initial_capacity
+        self.filters = []
+
+    def __len__(self):
+        return sum(f.count for f in self.filters)
+
+    def __contains__(self, item):
+        h1, h2 = get_hashes(item)
+        return any(f.contains(h1, h2) for f in self.filters)
+
+    def add(self, item):
+        h1, h2 = get_hashes(item)
+
+        if any(f.contains(h1, h2) for f in self.filters):
+            return
+
+        if not self.filters or self.filters[-1].full:
+            i = len(self.filters)
+            capacity = self.initial_capacity * self.GROWTH ** i
+            error_rate = self.error_rate * (1 - self.TIGHTENING) \
+                * self.TIGHTENING ** i
+            self.filters.append(BloomFilter(capacity, error_rate))
+
+        self.filters[-1].add(h1, h2)
+
+    def save(self, path):
+        path = Path(path)
+        if not path.parent.exists():
+            path.parent.mkdir(parents=True)
+
+        header = {
+            'error_rate': self.error_rate,
+            'initial_capacity': self.initial_capacity,
+            'filters': [{'capacity': f.capacity, 'error_rate': f.error_rate,
+                         'bits': f.bits, 'hashes': f.hashes,
+                         'count': f.count} for f in self.filters],
+        }
+
+        temp = path.with_suffix('.tmp')
+        with temp.open('wb') as file:
+            file.write(json.dumps(header).encode('utf-8') + b'\n')
+            for f in self.filters:
+                file.write(f.data)
+        temp.replace(path)
+
+    @classmethod
+    def load(cls, path):
+        with Path(path).open('rb') as file:
+            header = json.loads(file.readline().decode('utf-8'))
+
+            bloom = cls(header['error_rate'], header['initial_capacity'])
+            for info in header['filters']:
+                data = bytearray(file.read((info['bits'] + 7) // 8))
+                bloom.filters.append(BloomFilter(data=data, **info))
+
+        return bloom
@@ -0,0 +1,212 @@
+from array import array
+from collections import OrderedDict
+from pathlib import Path
+import shutil
+import sys
+import zipfile
+
+from dataset import Database
+
+
+# Each table is exported to exports/<table>.npz, with one array per column.
+# Strings are dictionary encoded: <column> holds int32 codes, and the
+# dictionary is stored as utf-8 bytes in <column>.values, split by the int64
+# <column>.offsets, like the CSR arrays of graph.py. Missing values are -1
+# for codes, integers and booleans, and NaN for floats.
+#
+# An .npz cannot be memory mapped while it is compressed, so Table unpacks
+# it once into cache/columns/<table>/ and memory maps the .npy files there.
+
+
+COLUMNS = {
+    'users': [
+        ('id', 'int64'),
+        ('login', 'string'),
+        ('company', 'string'),
+        ('location_country', 'string'),
+        ('location_latitude', 'float64'),
+        ('location_longitude', 'float64'),
+        ('hireable', 'bool'),
+        ('gender', 'string'),
+        ('gender_probability', 'float32'),
+        ('deleted', 'bool'),
+    ],
+    'repositories': [
+        ('owner', 'string'),
+        ('name', 'string'),
+        ('language', 'string'),
+        ('stargazers', 'int64'),
+        ('has_downloads', 'bool'),
+        ('is_fork', 'bool'),
+        ('has_issues', 'bool'),
+        ('watchers', 'int64'),
+        ('open_issues', 'int64'),
+        ('size', 'int64'),
+        ('has_wiki', 'bool'),
+        ('forks', 'int64'),
+    ],
+}
+
+TYPECODES = {
+    'int64': ('q', 'int64'),
+    'bool': ('b', 'int8'),
+    'float32': ('f', 'float32'),
+    'float64': ('d', 'float64'),
+    'string': ('i', 'int32'),
+}
+
+
+class ColumnBuilder:
+    def __init__(self, kind):
+        self.kind = kind
+        self.values = array(TYPECODES[kind][0])
+        self.dictionary = {}
+
+    def add(self, value):
+        if value is None:
+            value = float('nan') if self.kind.startswith('float') else -1
+        elif self.kind == 'string':
+            value = self.dictionary.setdefault(value, len(self.dictionary))
+        elif self.kind == 'bool':
+            value = int(bool(value))
+        elif self.kind == 'int64':
+            value = int(value)
+        else:
+            value = float(value)
+
+        self.values.append(value)
+
+    def arrays(self, name):
+        import numpy as np
+
+        dtype = TYPECODES[self.kind][1]
+        arrays = {name: np.frombuffer(self.values, dtype=dtype)}
+
+        if self.kind == 'string':
+            encoded = [value.encode('utf-8') for value in self.dictionary]
+
+            offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+            np.cumsum([len(value) for value in encoded], out=offsets[1:])
+
+            arrays[name + '.offsets'] = offsets
+            arrays[name + '.values'] = np.frombuffer(b''.join(encoded),
+                                                     dtype=np.uint8)
+
+        return arrays
+
+
+def export(database, table, path='exports'):
+    import numpy as np
+
+    names = [name for name, kind in COLUMNS[table]]
+    builders = [ColumnBuilder(kind) for name, kind in COLUMNS[table]]
+
+    count = 0
+    for row in database.iterate_rows(table, names):
+        for builder, value in zip(builders, row):
+            builder.add(value)
+
+        count += 1
+        if count % 100000 == 0:
+            print('Exported', count, table)
+
+    arrays = {}
+    for name, builder in zip(names, builders):
+        arrays.update(builder.arrays(name))
+
+    path = Path(path)
+    if not path.exists():
+        path.mkdir(parents=True)
+
+    temp = path / '{}.tmp.npz'.format(table)
+    np.savez_compressed(str(temp), **arrays)
+    temp.replace(path / '{}.npz'.format(table))
+
+    print('Exported', count, table)
+
+
+def export_all(tables=None, path='exports'):
+    database = Database()
+
+    for table in tables or sorted(COLUMNS):
+        export(database, table, path)
+
+    database.close()
+
+
+class Table:
+    def __init__(self, name, path='exports', cache='cache/columns'):
+        import numpy as np
+
+        archive = Path(path) / '{}.npz'.format(name)
+        self.path = Path(cache) / name
+
+        stat = archive.stat()
+        stamp = '{} {}'.format(stat.st_size, stat.st_mtime)
+
+        stamp_path = self.path / 'source.txt'
+        if not stamp_path.exists() or stamp_path.read_text() != stamp:
+            self.unpack(archive, stamp)
+
+        self.arrays = {p.name[:-len('.npy')]: np.load(str(p), mmap_mode='r')
+                       for p in self.path.glob('*.npy')}
+        self.dictionaries = {}
+
+    def unpack(self, archive, stamp):
+        print('Unpacking:', archive)
+
+        temp = self.path.with_name(self.path.name + '.tmp')
+        shutil.rmtree(str(temp), ignore_errors=True)
+
+        with zipfile.ZipFile(str(archive)) as file:
+            file.extractall(str(temp))
+        (temp / 'source.txt').write_text(stamp)
+
+        shutil.rmtree(str(self.path), ignore_errors=True)
+        temp.rename(self.path)
+
+    @property
+    def columns(self):
+        return sorted(name for name in self.arrays if '.' not in name)
+
+    def __len__(self):
+        return len(self.arrays[self.columns[0]])
+
+    def __getitem__(self, column):
+        return self.arrays[column]
+
+    def dictionary(self, column):
+        if column not in self.dictionaries:
+            offsets = self.arrays[column + '.offsets']
+            data = self.arrays[column + '.values'].tobytes()
+
+            self.dictionaries[column] = [
+                data[start:end].decode('utf-8')
+                for start, end in zip(offsets[:-1], offsets[1:])]
+
+        return self.dictionaries[column]
+
+    def decode(self, column):
+        import numpy as np
+
+        # the trailing None is what the -1 codes of missing values index
+        values = np.array(self.dictionary(column) + [None], dtype=object)
+        return values[self.arrays[column]]
+
+    def distribution(self, column, where=None):
+        import numpy as np
+
+        codes = self.arrays[column]
+        if where is not None:
+            codes = codes[where]
+
+        dictionary = self.dictionary(column)
+        counts = np.bincount(codes[codes >= 0], minlength=len(dictionary))
+
+        return OrderedDict((dictionary[i], int(counts[i]))
+                           for i in np.flatnonzero(counts))
+
+
+if __name__ == '__main__':
+    if sys.argv[1] == 'export':
+        export_all(sys.argv[2:])
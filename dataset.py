@@ -1,46 +1,205 @@
 import gc
 import gzip
+import hashlib
 import json
 from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from functools import lru_cache
 from pathlib import Path
+import queue
 import sys
+import threading
+import time
+import weakref
 
-import pymysql
-from joblib import Memory
+import profiling
 
-import settings
 
-memory = Memory('cache/dataset', verbose=0)
+_memory = None
+
+
+def get_memory():
+    global _memory
+
+    if _memory is None:
+        from joblib import Memory
+        _memory = Memory('cache/dataset', verbose=0)
+
+    return _memory
+
+
+def connect():
+    import pymysql
+
+    import settings
+
+    # init_command also runs when ping() reconnects a dropped connection
+    return pymysql.connect(host=settings.DB_HOST,
+                           user=settings.DB_USER,
+                           password=settings.DB_PASSWORD,
+                           db=settings.DB_NAME,
+                           charset='utf8',
+                           init_command=getattr(settings, 'DB_INIT_COMMAND',
+                                                None))
+
+
+@lru_cache(maxsize=256)
+def build_update_sql(table, keys, where):
+    update_str = ', '.join('{} = %s'.format(k) for k in keys)
+    where_str = ' AND '.join('{} = %s'.format(k) for k in where)
+    return 'UPDATE {} SET {} WHERE {}'.format(table, update_str, where_str)
+
+
+class ConnectionPool:
+    def __init__(self, size=4, connect=connect, max_idle_time=30):
+        self.connect = connect
+        self.max_idle_time = max_idle_time
+
+        self.slots = threading.BoundedSemaphore(size)
+        self.lock = threading.Lock()
+        self.idle = []
+        self.connections = []
+
+    def acquire(self):
+        self.slots.acquire()
+
+        try:
+            with self.lock:
+                entry = self.idle.pop() if self.idle else None
+
+            if entry is None:
+                connection = self.connect()
+                with self.lock:
+                    self.connections.append(connection)
+            else:
+                connection, released_at = entry
+
+                # the server may have dropped it while it sat in the pool
+                if time.time() - released_at > self.max_idle_time:
+                    connection.ping(reconnect=True)
+        except Exception:
+            self.slots.release()
+            raise
+
+        return connection
+
+    def release(self, connection):
+        with self.lock:
+            self.idle.append((connection, time.time()))
+        self.slots.release()
+
+    def close(self):
+        with self.lock:
+            connections = self.connections
+            self.connections = []
+            self.idle = []
+
+        for connection in connections:
+            try:
+                connection.close()
+            except Exception:
+                pass
+
+
+def return_connection(pool, connection):
+    # uncommitted work must not leak into the next thread's transaction
+    try:
+        connection.rollback()
+    finally:
+        pool.release(connection)
+
+
+class Lease:
+    # Kept in the thread's local storage, which is cleared when the thread
+    # exits, so a worker that never calls release() still frees its slot.
+
+    def __init__(self, pool, connection):
+        self.finalizer = weakref.finalize(self, return_connection, pool,
+                                          connection)
 
 
 class Database:
-    def __init__(self):
-        self.connection = pymysql.connect(host=settings.DB_HOST,
-                                          user=settings.DB_USER,
-                                          password=settings.DB_PASSWORD,
-                                          db=settings.DB_NAME,
-                                          charset='utf8')
+    # Each thread gets its own connection and cursor from the pool the
+    # first time it touches the database, and keeps them until release()
+    # or until the thread exits.
+
+    def __init__(self, pool=None, pool_size=4):
+        self.owns_pool = pool is None
+        self.pool = ConnectionPool(pool_size) if pool is None else pool
+        self.local = threading.local()
+
+    @property
+    def connection(self):
+        try:
+            return self.local.connection
+        except AttributeError:
+            connection = self.pool.acquire()
+            self.local.lease = Lease(self.pool, connection)
+            self.local.connection = connection
+            self.local.used_at = time.time()
+            return connection
 
     @property
     def cursor(self):
         try:
-            return self._cursor
+            return self.local.cursor
         except AttributeError:
-            self._cursor = self.connection.cursor()
-            return self._cursor
+            connection = self.connection
+
+            # a thread may hold its connection long enough for it to drop
+            if time.time() - self.local.used_at > self.pool.max_idle_time:
+                connection.ping(reconnect=True)
+
+            self.local.cursor = connection.cursor()
+            return self.local.cursor
 
     def commit(self):
         self.connection.commit()
-        self._cursor.close()
-        del self._cursor
+        self.local.used_at = time.time()
+
+        profiling.checkpoint('commit')
+
+        try:
+            self.local.cursor.close()
+        except AttributeError:
+            pass
+        else:
+            del self.local.cursor
+
+    def release(self):
+        if not hasattr(self.local, 'connection'):
+            return
+
+        try:
+            self.local.cursor.close()
+        except AttributeError:
+            pass
+        else:
+            del self.local.cursor
+
+        del self.local.connection
+
+        lease = self.local.lease
+        del self.local.lease
+        lease.finalizer()
+
+    @contextmanager
+    def session(self):
+        try:
+            yield self
+        finally:
+            self.release()
 
     def close(self):
-        self.connection.close()
+        self.release()
+
+        if self.owns_pool:
+            self.pool.close()
 
     @property
     def count_users(self):
         self.cursor.execute('SELECT COUNT(*) FROM users')
-        counter['users'] = self.cursor.fetchone()[0]
+        return self.cursor.fetchone()[0]
 
     def count(self):
         counter = Counter()
@@ -57,11 +216,83 @@ class Database:
 
         return counter
 
+    def get_table_version(self, table):
+        # COUNT(*) misses updates in place, such as locations and genders
+        # being filled in, and information_schema's UPDATE_TIME is NULL for
+        # InnoDB on older servers and lost on restart, so checksum the rows
+        self.cursor.execute('CHECKSUM TABLE {}'.format(table))
+        row = self.cursor.fetchone()
+
+        # a missing table has a NULL checksum, which is never cached
+        return None if row is None else row[1]
+
     def has_user(self, user_login):
         sql = 'SELECT COUNT(*) FROM users WHERE login = %s'
         self.cursor.execute(sql, (user_login,))
         return self.cursor.fetchone()[0] > 0
 
+    def get_existing_logins(self, logins):
+        existing = set()
+        logins = list(logins)
+
+        for i in range(0, len(logins), 1000):
+            chunk = logins[i:i + 1000]
+            sql = 'SELECT login FROM users WHERE login IN ({})' \
+                .format(', '.join(['%s'] * len(chunk)))
+            self.cursor.execute(sql, chunk)
+            existing.update(row[0] for row in self.cursor)
+
+        return existing
+
+    def get_existing_repositories(self, repos):
+        existing = set()
+        repos = list(repos)
+
+        for i in range(0, len(repos), 1000):
+            chunk = repos[i:i + 1000]
+            sql = """
+                SELECT owner, name
+                FROM repositories
+                WHERE (owner, name) IN ({})
+            """.format(', '.join(['(%s, %s)'] * len(chunk)))
+            self.cursor.execute(sql, [v for repo in chunk for v in repo])
+            existing.update(tuple(row) for row in self.cursor)
+
+        return existing
+
+    def iterate_logins(self):
+        import pymysql.cursors
+
+        cursor = self.connection.cursor(pymysql.cursors.SSCursor)
+        cursor.execute('SELECT login FROM users WHERE login IS NOT NULL')
+
+        for row in cursor:
+            yield row[0]
+
+        cursor.close()
+
+    def iterate_repositories(self):
+        import pymysql.cursors
+
+        cursor = self.connection.cursor(pymysql.cursors.SSCursor)
+        cursor.execute('SELECT owner, name FROM repositories')
+
+        for row in cursor:
+            yield tuple(row)
+
+        cursor.close()
+
+    def iterate_rows(self, table, columns):
+        import pymysql.cursors
+
+        cursor = self.connection.cursor(pymysql.cursors.SSCursor)
+        cursor.execute('SELECT {} FROM {}'.format(', '.join(columns), table))
+
+        for row in cursor:
+            yield row
+
+        cursor.close()
+
     def insert_user(self, login):
         sql = 'INSERT IGNORE INTO users (login) VALUES (%s)'
         self.cursor.execute(sql, (login,))
@@ -70,6 +301,10 @@ class Database:
         sql = 'INSERT IGNORE INTO users (login) VALUES (%s)'
         self.cursor.executemany(sql, [(v,) for v in logins])
 
+    def insert_many_users_with_ids(self, users):
+        sql = 'INSERT IGNORE INTO users (id, login) VALUES (%s, %s)'
+        self.cursor.executemany(sql, users)
+
     def insert_many_repositories(self, repos):
         sql = 'INSERT IGNORE INTO repositories (owner, name) VALUES (%s, %s)'
         self.cursor.executemany(sql, repos)
@@ -79,14 +314,10 @@ class Database:
             if fields[key] is None:
                 del fields[key]
 
-        keys = list(fields.keys())
+        keys = tuple(fields.keys())
         values = list(fields.values())
 
-        fields_str = ', '.join(keys)
-        values_str = ', '.join(['%s'] * len(fields))
-        update_str = ', '.join('{} = %s'.format(k) for k in keys)
-        sql = 'UPDATE users SET {} WHERE login = %s' \
-            .format(update_str)
+        sql = build_update_sql('users', keys, ('login',))
         self.cursor.execute(sql, values + [login])
 
     def update_project(self, owner, name, fields):
@@ -94,14 +325,10 @@ class Database:
             if fields[key] is None:
                 del fields[key]
 
-        keys = list(fields.keys())
+        keys = tuple(fields.keys())
         values = list(fields.values())
 
-        fields_str = ', '.join(keys)
-        values_str = ', '.join(['%s'] * len(fields))
-        update_str = ', '.join('{} = %s'.format(k) for k in keys)
-        sql = 'UPDATE repositories SET {} WHERE owner = %s AND name = %s' \
-            .format(update_str)
+        sql = build_update_sql('repositories', keys, ('owner', 'name'))
         self.cursor.execute(sql, values + [owner, name])
 
     def update_user_activity(self, first_active, last_active):
@@ -137,7 +364,7 @@ class Database:
             WHERE company IS NOT NULL
             GROUP BY company
         """)
-        return OrderedDict(cself.ursor)
+        return OrderedDict(self.cursor)
 
     def get_country_distribution(self):
         self.cursor.execute("""
@@ -168,6 +395,17 @@ class Database:
         for row in self.cursor:
             yield row
 
+    def get_user_countries(self):
+        self.cursor.execute("""
+            SELECT login, location_country
+            FROM users
+            WHERE location_country IS NOT NULL
+                AND location_country != '?'
+        """)
+
+        for row in self.cursor:
+            yield row
+
     def get_users_without_location(self):
         self.cursor.execute("""
             SELECT login, location
@@ -229,13 +467,156 @@ class Database:
         self.cursor.execute(sql, (login,))
 
 
+class BackgroundWriter:
+    # Runs Database writes on a thread with its own connection, so the
+    # producer can keep decoding events while MySQL works. Operations are
+    # sent in chunks over a bounded queue, which blocks the producer when
+    # the writer falls behind. The writer grows its batches while commits
+    # are a large share of the time spent and shrinks them when they are
+    # cheap.
+
+    CHUNK_SIZE = 500
+    MIN_BATCH_SIZE = 100
+    MAX_BATCH_SIZE = 50000
+
+    # queued after a chunk to commit it without waiting for the batch, and
+    # instead of the final None to roll back whatever is not yet committed
+    FLUSH = 'flush'
+    ABORT = 'abort'
+
+    def __init__(self, connect=None, max_pending=8, batch_size=1000):
+        self.connect = Database if connect is None else connect
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.batch_size = batch_size
+
+        self.chunk = []
+        self.error = None
+
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # work from a producer that failed part way is not committed, and
+        # the producer's exception is the one that propagates
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def submit(self, method, *args):
+        if self.error is not None:
+            raise self.error
+
+        self.chunk.append((method, args))
+
+        if len(self.chunk) >= self.CHUNK_SIZE:
+            self.queue.put(self.chunk)
+            self.chunk = []
+
+    def flush(self):
+        if self.error is not None:
+            raise self.error
+
+        if self.chunk:
+            self.queue.put(self.chunk)
+            self.chunk = []
+
+        self.queue.put(self.FLUSH)
+
+    def close(self):
+        if self.chunk:
+            self.queue.put(self.chunk)
+            self.chunk = []
+
+        self.queue.put(None)
+        self.thread.join()
+
+        if self.error is not None:
+            raise self.error
+
+    def abort(self):
+        self.chunk = []
+
+        self.queue.put(self.ABORT)
+        self.thread.join()
+
+    def adjust(self, write_time, commit_time):
+        if commit_time > write_time * 0.1:
+            self.batch_size = min(self.batch_size * 2, self.MAX_BATCH_SIZE)
+        elif commit_time < write_time * 0.025:
+            self.batch_size = max(self.batch_size // 2, self.MIN_BATCH_SIZE)
+
+    def run(self):
+        database = None
+        pending = 0
+        write_time = 0
+
+        while True:
+            chunk = self.queue.get()
+            if chunk is None or chunk == self.ABORT:
+                break
+
+            # keep draining after a failure, so the producer never blocks
+            if self.error is not None:
+                continue
+
+            try:
+                if database is None:
+                    database = self.connect()
+
+                if chunk == self.FLUSH:
+                    if pending > 0:
+                        database.commit()
+                        pending = 0
+                        write_time = 0
+                    continue
+
+                start = time.time()
+                for method, args in chunk:
+                    getattr(database, method)(*args)
+                write_time += time.time() - start
+                pending += len(chunk)
+
+                if pending >= self.batch_size:
+                    start = time.time()
+                    database.commit()
+                    self.adjust(write_time, time.time() - start)
+                    pending = 0
+                    write_time = 0
+            except Exception as e:
+                self.error = e
+
+        try:
+            if database is not None:
+                if pending > 0 and self.error is None and chunk is None:
+                    database.commit()
+                database.close()
+        except Exception as e:
+            if self.error is None:
+                self.error = e
+
+
 class Events:
     def __init__(self):
         self.path = Path('../data')
 
+        memory = get_memory()
         self.count = memory.cache(self.count)
         self.count_types = memory.cache(self.count_types)
 
+    def get_manifest_checksum(self, glob='*.json.gz'):
+        checksum = hashlib.sha1()
+
+        for path in sorted(self.path.glob(glob)):
+            stat = path.stat()
+            line = '{} {} {}\n'.format(path.name, stat.st_size, stat.st_mtime)
+            checksum.update(line.encode('utf-8'))
+
+        return checksum.hexdigest()
+
     def iterate(self, glob='*.json.gz', func=None, start_from=None):
         gc.disable()
 
@@ -250,6 +631,8 @@ class Events:
                     continue
 
             print('Loading events:', path)
+            profiling.checkpoint('file')
+
             with gzip.open(str(path), 'rt', errors='ignore') as file:
                 for line in file:
                     try:
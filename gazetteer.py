@@ -0,0 +1,181 @@
+from pathlib import Path
+import unicodedata
+
+
+# more specific places win when several agree on the country
+KIND_RANKS = {'city': 0, 'region': 1, 'country': 2}
+
+# names this short, such as 'SF' or 'CA', are codes rather than words and
+# only match a whole comma separated part, or follow another match in it
+MAX_CODE_LENGTH = 3
+
+IGNORED_TOKENS = {'the', 'greater', 'area', 'metro', 'metropolitan', 'of',
+                  'in', 'near', 'based', 'downtown', 'region'}
+
+
+def normalise(text):
+    text = unicodedata.normalize('NFKD', text)
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    text = ''.join(c if c.isalnum() else ' ' for c in text.casefold())
+    return tuple(text.split())
+
+
+class Place:
+    def __init__(self, kind, country_code, country_name, region, name,
+                 latitude, longitude, confidence=None):
+        self.kind = kind
+        self.country_code = country_code
+        self.country_name = country_name
+        self.region = region
+        self.name = name
+        self.latitude = latitude
+        self.longitude = longitude
+        self.confidence = confidence
+
+    def with_confidence(self, confidence):
+        return Place(self.kind, self.country_code, self.country_name,
+                     self.region, self.name, self.latitude, self.longitude,
+                     confidence)
+
+    @property
+    def raw(self):
+        # the same shape as a Google geocoder result, for get_country
+        return {
+            'address_components': [{
+                'types': ['country'],
+                'short_name': self.country_code,
+                'long_name': self.country_name,
+            }],
+        }
+
+    def __repr__(self):
+        return 'Place({!r}, {!r}, {})'.format(self.name, self.country_code,
+                                              self.confidence)
+
+
+class Gazetteer:
+    def __init__(self, path='resources/gazetteer.tsv'):
+        self.trie = {}
+        self.load(Path(path))
+
+    def load(self, path):
+        rows = []
+        country_names = {}
+
+        with path.open(encoding='utf-8') as file:
+            for line in file:
+                if line.startswith('#') or not line.strip():
+                    continue
+
+                kind, code, region, latitude, longitude, names = \
+                    line.rstrip('\n').split('\t')
+                names = names.split('|')
+                rows.append((kind, code, region, float(latitude),
+                             float(longitude), names))
+
+                if kind == 'country':
+                    country_names[code] = names[0]
+
+        for kind, code, region, latitude, longitude, names in rows:
+            place = Place(kind, code, country_names.get(code, code),
+                          region, names[0], latitude, longitude)
+            for name in names:
+                self.insert(name, place)
+
+    def insert(self, name, place):
+        tokens = normalise(name)
+        if not tokens:
+            return
+
+        is_code = len(name.replace('.', '')) <= MAX_CODE_LENGTH
+
+        node = self.trie
+        for token in tokens:
+            node = node.setdefault(token, {})
+
+        places = node.setdefault(None, [])
+        if (place, is_code) not in places:
+            places.append((place, is_code))
+
+    def match(self, tokens, start, allow_codes):
+        node = self.trie
+        best = None
+
+        for end in range(start, len(tokens)):
+            node = node.get(tokens[end])
+            if node is None:
+                break
+
+            places = [place for place, is_code in node.get(None, [])
+                      if allow_codes(start, end + 1) or not is_code]
+            if places:
+                best = (end + 1, places)
+
+        return best
+
+    def scan(self, tokens):
+        groups = []
+        unmatched = 0
+
+        def allow_codes(start, end):
+            if all(token in IGNORED_TOKENS for token in tokens[start:end]):
+                return False
+            return (start == 0 and end == len(tokens)) or bool(groups)
+
+        i = 0
+        while i < len(tokens):
+            found = self.match(tokens, i, allow_codes)
+            if found is None:
+                if tokens[i] not in IGNORED_TOKENS:
+                    unmatched += 1
+                i += 1
+            else:
+                i, places = found
+                groups.append(places)
+
+        return groups, unmatched
+
+    def lookup(self, text):
+        groups = []
+        unmatched = 0
+
+        for part in text.split(','):
+            part_groups, part_unmatched = self.scan(normalise(part))
+            groups.extend(part_groups)
+            unmatched += part_unmatched
+
+        if not groups:
+            return None
+
+        # the countries that agree with the most matched names
+        coverage = {}
+        for places in groups:
+            for code in {place.country_code for place in places}:
+                coverage[code] = coverage.get(code, 0) + 1
+
+        best = max(coverage.values())
+        countries = [code for code, count in coverage.items()
+                     if count == best]
+
+        confidence = best / len(groups)
+        if unmatched > 0 or len(countries) > 1:
+            confidence /= 2
+
+        candidates = [(KIND_RANKS[place.kind], i, place)
+                      for i, places in enumerate(groups)
+                      for place in places
+                      if place.country_code == countries[0]]
+        place = min(candidates, key=lambda c: (c[0], c[1]))[2]
+
+        # 'Portland, ME' agrees on the country with Portland, Oregon, but
+        # not on the region. Names such as 'LA' that could also be a city
+        # don't count as naming a region.
+        if place.kind == 'city':
+            regions = {p.region for places in groups
+                       if not any(p.kind == 'city' for p in places)
+                       for p in places
+                       if p.kind == 'region' and p.country_code == countries[0]}
+            if regions and regions != {place.region}:
+                confidence /= 2
+
+        return place.with_confidence(confidence)
@@ -0,0 +1,269 @@
+from array import array
+import json
+from pathlib import Path
+import sys
+
+from dataset import Database
+from scrape import RequestError
+
+
+# Users are interned to int32 ids in the order they are first seen, which
+# is also the breadth first order they are expanded in, so the frontier is
+# just the id of the next user to expand. Edges are appended to a binary
+# log of (source, target) pairs, which build() turns into a CSR graph of
+# int32 offsets and targets that FollowGraph memory maps.
+
+
+class FollowCrawler:
+    def __init__(self, github, path='cache/graph'):
+        self.github = github
+        self.path = Path(path)
+
+        if not self.path.exists():
+            self.path.mkdir(parents=True)
+
+        self.logins_path = self.path / 'logins.txt'
+        self.edges_path = self.path / 'edges.bin'
+        self.state_path = self.path / 'state.json'
+
+        self.load()
+
+    def load(self):
+        try:
+            with self.state_path.open() as file:
+                self.state = json.load(file)
+        except FileNotFoundError:
+            self.state = {'head': 0, 'logins': 0, 'edges': 0}
+
+        self.logins = []
+        if self.logins_path.exists():
+            with self.logins_path.open() as file:
+                self.logins = file.read().splitlines()
+
+        # throw away anything written after the last checkpoint
+        del self.logins[self.state['logins']:]
+        with self.logins_path.open('w') as file:
+            file.writelines(login + '\n' for login in self.logins)
+
+        with self.edges_path.open('ab') as file:
+            file.truncate(self.state['edges'] * 2 * 4)
+
+        self.ids = {login: i for i, login in enumerate(self.logins)}
+
+    def save(self, new_logins, edges):
+        with self.logins_path.open('a') as file:
+            file.writelines(login + '\n' for login in new_logins)
+
+        with self.edges_path.open('ab') as file:
+            edges.tofile(file)
+
+        self.state['logins'] = len(self.logins)
+        self.state['edges'] += len(edges) // 2
+
+        temp = self.state_path.with_suffix('.tmp')
+        with temp.open('w') as file:
+            json.dump(self.state, file)
+        temp.replace(self.state_path)
+
+    def intern(self, login, new_logins):
+        try:
+            return self.ids[login]
+        except KeyError:
+            user_id = len(self.logins)
+            self.ids[login] = user_id
+            self.logins.append(login)
+            new_logins.append(login)
+            return user_id
+
+    def crawl(self, seed, max_users=None):
+        if not self.logins:
+            self.intern(seed, [])
+            self.save([seed], array('i'))
+
+        while self.state['head'] < len(self.logins):
+            if max_users is not None and self.state['head'] >= max_users:
+                break
+
+            source = self.state['head']
+            login = self.logins[source]
+
+            new_logins = []
+            edges = array('i')
+
+            try:
+                for user in self.github.get_following_users(login):
+                    target = self.intern(user['login'], new_logins)
+                    edges.append(source)
+                    edges.append(target)
+            except RequestError as e:
+                # move past the user, or every restart stops here again
+                print('Skipping', login + ':', e)
+
+            self.state['head'] += 1
+            self.save(new_logins, edges)
+
+            print('Following', login, '->', len(edges) // 2, 'users',
+                  '({} of {})'.format(self.state['head'], len(self.logins)))
+
+
+def build(path='cache/graph'):
+    import numpy as np
+
+    path = Path(path)
+
+    with (path / 'state.json').open() as file:
+        state = json.load(file)
+
+    count = state['logins']
+
+    edges = np.fromfile(str(path / 'edges.bin'), dtype=np.int32,
+                        count=state['edges'] * 2).reshape(-1, 2)
+    sources = edges[:, 0]
+    targets = edges[:, 1]
+
+    # the crawler writes edges in source order, but be safe
+    if np.any(sources[1:] < sources[:-1]):
+        order = np.argsort(sources, kind='mergesort')
+        sources = sources[order]
+        targets = targets[order]
+
+    offsets = np.zeros(count + 1, dtype=np.int32)
+    np.cumsum(np.bincount(sources, minlength=count), out=offsets[1:])
+
+    np.save(str(path / 'offsets.npy'), offsets)
+    np.save(str(path / 'targets.npy'), targets.astype(np.int32))
+
+
+class FollowGraph:
+    def __init__(self, path='cache/graph'):
+        import numpy as np
+
+        path = Path(path)
+
+        self.offsets = np.load(str(path / 'offsets.npy'), mmap_mode='r')
+        self.targets = np.load(str(path / 'targets.npy'), mmap_mode='r')
+
+        with (path / 'logins.txt').open() as file:
+            self.logins = file.read().splitlines()[:len(self)]
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def following(self, user_id):
+        return self.targets[self.offsets[user_id]:self.offsets[user_id + 1]]
+
+    @property
+    def sources(self):
+        import numpy as np
+        return np.repeat(np.arange(len(self), dtype=np.int32),
+                         self.out_degree)
+
+    @property
+    def out_degree(self):
+        import numpy as np
+        return np.diff(self.offsets)
+
+    @property
+    def in_degree(self):
+        import numpy as np
+        return np.bincount(self.targets, minlength=len(self))
+
+    def degree_distribution(self, direction='in'):
+        import numpy as np
+
+        if direction == 'in':
+            degree = self.in_degree
+        elif direction == 'out':
+            degree = self.out_degree
+        else:
+            raise ValueError(direction)
+
+        return np.bincount(degree)
+
+    def pagerank(self, damping=0.85, iterations=100, tolerance=1e-9):
+        import numpy as np
+
+        count = len(self)
+        out_degree = self.out_degree.astype(np.float64)
+        dangling = out_degree == 0
+        out_degree[dangling] = 1
+
+        sources = self.sources
+        targets = self.targets
+
+        rank = np.full(count, 1 / count)
+
+        for _ in range(iterations):
+            contributions = (rank / out_degree)[sources]
+            new_rank = np.bincount(targets, weights=contributions,
+                                   minlength=count)
+
+            # users who follow nobody spread their rank evenly
+            new_rank += rank[dangling].sum() / count
+            new_rank = damping * new_rank + (1 - damping) / count
+
+            delta = np.abs(new_rank - rank).sum()
+            rank = new_rank
+
+            if delta < tolerance:
+                break
+
+        return rank
+
+    def country_matrix(self, countries):
+        import numpy as np
+
+        # matrix[i, j] counts users in codes[i] following users in codes[j]
+        codes = sorted(set(countries.values()))
+        index = {code: i for i, code in enumerate(codes)}
+
+        user_countries = np.full(len(self), -1, dtype=np.int32)
+        for user_id, login in enumerate(self.logins):
+            code = countries.get(login)
+            if code is not None:
+                user_countries[user_id] = index[code]
+
+        source_countries = user_countries[self.sources]
+        target_countries = user_countries[self.targets]
+        known = (source_countries >= 0) & (target_countries >= 0)
+
+        pairs = source_countries[known].astype(np.int64) * len(codes) \
+            + target_countries[known]
+        matrix = np.bincount(pairs, minlength=len(codes) ** 2)
+
+        return codes, matrix.reshape(len(codes), len(codes))
+
+
+def stats():
+    import numpy as np
+
+    graph = FollowGraph()
+
+    print('Users:', len(graph))
+    print('Follows:', len(graph.targets))
+
+    in_degree = graph.in_degree
+    print('Mean followers:', in_degree.mean())
+    print('Max followers:', in_degree.max())
+
+    rank = graph.pagerank()
+    print('Top users by PageRank:')
+    for user_id in np.argsort(rank)[::-1][:20]:
+        print(' ', graph.logins[user_id], rank[user_id])
+
+    database = Database()
+    countries = dict(database.get_user_countries())
+    database.close()
+
+    codes, matrix = graph.country_matrix(countries)
+    print('Top country to country follows:')
+    for i in np.argsort(matrix, axis=None)[::-1][:20]:
+        source, target = np.unravel_index(i, matrix.shape)
+        print(' ', codes[source], '->', codes[target], matrix[source, target])
+
+
+if __name__ == '__main__':
+    if sys.argv[1] == 'build':
+        build()
+    elif sys.argv[1] == 'stats':
+        stats()
@@ -0,0 +1,169 @@
+from collections import Counter
+from contextlib import contextmanager
+import os
+from pathlib import Path
+import random
+import sys
+import threading
+import time
+
+
+# the profiler of the current process, if this run is being profiled
+active = None
+
+
+class StackSampler(threading.Thread):
+    def __init__(self, interval):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.counts = Counter()
+        self.stopped = threading.Event()
+
+    def run(self):
+        me = threading.get_ident()
+
+        while not self.stopped.wait(self.interval):
+            names = {thread.ident: thread.name
+                     for thread in threading.enumerate()}
+
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append('{}:{}'.format(
+                        os.path.basename(code.co_filename), code.co_name))
+                    frame = frame.f_back
+
+                stack.append(names.get(ident, str(ident)))
+                self.counts[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+    def write(self, path):
+        with path.open('w') as file:
+            for stack, count in self.counts.most_common():
+                file.write('{} {}\n'.format(stack, count))
+
+
+class Profiler:
+    def __init__(self, path, memory_points=(), interval=0.01, cpu=True):
+        self.path = Path(path)
+        self.memory_points = set(memory_points)
+        self.interval = interval
+        self.cpu = cpu
+
+        self.stage_name = None
+        self.snapshots = Counter()
+
+    def file(self, name, suffix):
+        if not self.path.exists():
+            self.path.mkdir(parents=True, exist_ok=True)
+        return self.path / '{}-{}.{}'.format(name, os.getpid(), suffix)
+
+    @contextmanager
+    def stage(self, name):
+        import cProfile
+        import tracemalloc
+
+        outer = self.stage_name
+        self.stage_name = name
+
+        sampler = StackSampler(self.interval)
+        sampler.start()
+
+        # cProfile cannot nest, so only the outermost stage gets one
+        profile = None
+        if self.cpu and outer is None:
+            profile = cProfile.Profile()
+            profile.enable()
+
+        tracing = self.memory_points and not tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.start()
+
+        try:
+            yield
+        finally:
+            if profile is not None:
+                profile.disable()
+                profile.dump_stats(str(self.file(name, 'pstats')))
+
+            sampler.stop()
+            sampler.write(self.file(name, 'collapsed'))
+
+            if tracing:
+                self.checkpoint('end')
+                tracemalloc.stop()
+
+            self.stage_name = outer
+
+    def checkpoint(self, point):
+        import tracemalloc
+
+        if point != 'end' and point not in self.memory_points:
+            return
+        if not tracemalloc.is_tracing():
+            return
+
+        key = '{}-{}'.format(self.stage_name, point)
+        self.snapshots[key] += 1
+
+        name = '{}-{}'.format(key, self.snapshots[key])
+        tracemalloc.take_snapshot().dump(str(self.file(name, 'tracemalloc')))
+
+
+def checkpoint(point):
+    if active is not None:
+        active.checkpoint(point)
+
+
+@contextmanager
+def stage(name):
+    if active is None:
+        yield
+    else:
+        with active.stage(name):
+            yield
+
+
+# Strips the profiling options out of argv:
+#
+#   --profile[=DIR]          profile this run, writing to DIR
+#   --profile-memory=POINTS  take tracemalloc snapshots at each of the comma
+#                            separated POINTS ('commit', 'file')
+#   --profile-rate=RATE      only profile this fraction of runs
+#   --profile-no-cpu         skip cProfile and only sample stacks
+def parse_args(argv, script):
+    global active
+
+    path = None
+    memory_points = []
+    rate = 1.0
+    cpu = True
+
+    remaining = []
+    for arg in argv:
+        if arg == '--profile':
+            path = 'profiles/{}-{}'.format(script,
+                                           time.strftime('%Y%m%d-%H%M%S'))
+        elif arg.startswith('--profile='):
+            path = arg.split('=', 1)[1]
+        elif arg.startswith('--profile-memory='):
+            memory_points = arg.split('=', 1)[1].split(',')
+        elif arg.startswith('--profile-rate='):
+            rate = float(arg.split('=', 1)[1])
+        elif arg == '--profile-no-cpu':
+            cpu = False
+        else:
+            remaining.append(arg)
+
+    if path is not None and random.random() < rate:
+        active = Profiler(path, memory_points, cpu=cpu)
+        print('Profiling to:', path)
+
+    return remaining
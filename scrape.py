@@ -1,20 +1,34 @@
+import json
+from pathlib import Path
+import queue
+import sqlite3
 import sys
+import threading
 import time
 import warnings
 
-import geopy.exc
-from geopy.geocoders import GoogleV3
-from joblib import Memory
-import pymysql
-import requests
+from dataset import BackgroundWriter, Database, Events
+import profiling
 
-from dataset import Database, Events
-import settings
 
+_memory = None
 
-warnings.filterwarnings('ignore', category=pymysql.Warning)
 
-memory = Memory('cache/scrape', verbose=0)
+def get_memory():
+    global _memory
+
+    if _memory is None:
+        from joblib import Memory
+        _memory = Memory('cache/scrape', verbose=0)
+
+    return _memory
+
+
+class RequestError(RuntimeError):
+    def __init__(self, url, status_code):
+        super().__init__('{} returned {}'.format(url, status_code))
+        self.url = url
+        self.status_code = status_code
 
 
 class RateLimitError(RuntimeError):
@@ -39,25 +53,156 @@ class RateLimitError(RuntimeError):
         time.sleep(seconds)
 
 
+HTTP_CACHE_SIZE = 1024 * 1024 * 1024
+
+
+class HTTPCache:
+    def __init__(self, path='cache/scrape/http.sqlite',
+                 max_size=HTTP_CACHE_SIZE):
+        path = Path(path)
+        if not path.parent.exists():
+            path.parent.mkdir(parents=True)
+
+        self.max_size = max_size
+        self.lock = threading.Lock()
+
+        self.connection = sqlite3.connect(str(path), check_same_thread=False)
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                url TEXT PRIMARY KEY,
+                etag TEXT,
+                last_modified TEXT,
+                links TEXT,
+                body BLOB,
+                size INTEGER,
+                used REAL
+            )
+        """)
+        self.connection.commit()
+
+    def get(self, url):
+        with self.lock:
+            row = self.connection.execute("""
+                SELECT etag, last_modified, links, body
+                FROM responses
+                WHERE url = ?
+            """, (url,)).fetchone()
+
+            if row is None:
+                return None
+
+            self.connection.execute(
+                'UPDATE responses SET used = ? WHERE url = ?',
+                (time.time(), url))
+            self.connection.commit()
+
+        etag, last_modified, links, body = row
+        return {
+            'etag': etag,
+            'last_modified': last_modified,
+            'links': json.loads(links),
+            'body': bytes(body),
+        }
+
+    def put(self, url, etag, last_modified, links, body):
+        with self.lock:
+            self.connection.execute("""
+                REPLACE INTO responses
+                    (url, etag, last_modified, links, body, size, used)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, (url, etag, last_modified, json.dumps(links), body,
+                  len(body), time.time()))
+            self.evict()
+            self.connection.commit()
+
+    def evict(self):
+        size = self.connection.execute(
+            'SELECT IFNULL(SUM(size), 0) FROM responses').fetchone()[0]
+
+        if size <= self.max_size:
+            return
+
+        rows = self.connection.execute(
+            'SELECT url, size FROM responses ORDER BY used')
+
+        evicted = []
+        for url, entry_size in rows:
+            if size <= self.max_size:
+                break
+            evicted.append((url,))
+            size -= entry_size
+
+        self.connection.executemany(
+            'DELETE FROM responses WHERE url = ?', evicted)
+
+
+class CachedResponse:
+    def __init__(self, response, entry):
+        self.status_code = 200
+        self.headers = response.headers
+        self.links = entry['links']
+        self.content = entry['body']
+
+    def json(self):
+        return json.loads(self.content.decode('utf-8'))
+
+
 class GitHub:
-    def __init__(self):
-        self.client_id = settings.CLIENT_ID
-        self.client_secret = settings.CLIENT_SECRET
+    def __init__(self, client_id=None, client_secret=None, cache=None):
+        if client_id is None:
+            import settings
+            client_id = settings.CLIENT_ID
+            client_secret = settings.CLIENT_SECRET
+
+        self.client_id = client_id
+        self.client_secret = client_secret
+
+        self.cache = HTTPCache() if cache is None else cache
+
+        self.remaining = None
+        self.reset_time = 0
 
     def get(self, url, params=None):
+        import requests
+
         if params is None:
             params = {}
 
+        # cache on the url without the credentials, so every credential
+        # shares the same entries
+        cache_url = requests.Request('GET', url, params=params).prepare().url
+        entry = self.cache.get(cache_url)
+
+        headers = {}
+        if entry is not None:
+            if entry['etag'] is not None:
+                headers['If-None-Match'] = entry['etag']
+            if entry['last_modified'] is not None:
+                headers['If-Modified-Since'] = entry['last_modified']
+
         params['client_id'] = self.client_id
         params['client_secret'] = self.client_secret
 
-        response = requests.get(url, params=params)
+        response = requests.get(url, params=params, headers=headers)
 
         headers = response.headers
+        self.remaining = int(headers['X-RateLimit-Remaining'])
+        self.reset_time = int(headers['X-RateLimit-Reset'])
+
+        # 304s do not count against the rate limit
+        if response.status_code == 304 and entry is not None:
+            return CachedResponse(response, entry)
+
         if headers['X-RateLimit-Remaining'] == '0':
             reset_time = int(headers['X-RateLimit-Reset'])
             raise RateLimitError(reset_time)
 
+        etag = headers.get('ETag')
+        last_modified = headers.get('Last-Modified')
+        if response.status_code == 200 and (etag or last_modified):
+            self.cache.put(cache_url, etag, last_modified, response.links,
+                           response.content)
+
         return response
 
     def get_all_users(self, since=0):
@@ -79,6 +224,10 @@ class GitHub:
         while next_url is not None:
             response = self.get(next_url)
 
+            # a renamed or deleted user is a 404 with a message body
+            if response.status_code != 200:
+                raise RequestError(next_url, response.status_code)
+
             try:
                 next_url = response.links['next']['url']
             except KeyError:
@@ -88,14 +237,191 @@ class GitHub:
                 yield user
 
 
+class TokenPool:
+    def __init__(self, credentials=None, cache=None):
+        if credentials is None:
+            import settings
+            credentials = getattr(settings, 'GITHUB_CREDENTIALS', None)
+            if not credentials:
+                credentials = [(settings.CLIENT_ID, settings.CLIENT_SECRET)]
+
+        if cache is None:
+            cache = HTTPCache()
+
+        self.clients = [GitHub(client_id, client_secret, cache)
+                        for client_id, client_secret in credentials]
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.clients)
+
+    def acquire(self):
+        now = int(time.time())
+
+        with self.lock:
+            available = [client for client in self.clients
+                         if client.remaining is None or client.remaining > 0
+                         or client.reset_time <= now]
+
+            if not available:
+                reset_time = min(client.reset_time for client in self.clients)
+                raise RateLimitError(reset_time)
+
+            # unknown budgets first, then whichever has the most left
+            return max(available, key=lambda client: (
+                client.remaining is None, client.remaining or 0))
+
+
+class RangeCheckpoints:
+    def __init__(self, path='cache/scrape/all_users'):
+        self.path = Path(path)
+
+    def file(self, start, end):
+        return self.path / '{}-{}.json'.format(start, end)
+
+    def load(self, start, end):
+        try:
+            with self.file(start, end).open() as file:
+                return json.load(file)['since']
+        except FileNotFoundError:
+            return start
+
+    def save(self, start, end, since):
+        if not self.path.exists():
+            self.path.mkdir(parents=True)
+
+        # write then rename, so a crash never leaves a half written file
+        path = self.file(start, end)
+        temp = path.with_suffix('.tmp')
+        with temp.open('w') as file:
+            json.dump({'since': since}, file)
+        temp.replace(path)
+
+
+class UserCrawler:
+    def __init__(self, database, pool=None, checkpoints=None):
+        self.database = database
+        self.pool = TokenPool() if pool is None else pool
+        self.checkpoints = RangeCheckpoints() \
+            if checkpoints is None else checkpoints
+
+    @staticmethod
+    def split(since, until, count):
+        step = max(1, -(-(until - since) // count))
+        return [(start, min(start + step, until))
+                for start in range(since, until, step)]
+
+    def crawl_range(self, start, end, results):
+        since = self.checkpoints.load(start, end)
+
+        while since < end:
+            client = self.pool.acquire()
+
+            try:
+                response = client.get('https://api.github.com/users',
+                                      {'since': since, 'per_page': 100})
+            except RateLimitError:
+                continue  # try again with another credential
+
+            users = response.json()
+            if not users:
+                since = end
+            else:
+                since = min(users[-1]['id'], end)
+
+            users = [user for user in users if user['id'] <= end]
+            results.put((start, end, users, since))
+
+    def work(self, ranges, results):
+        try:
+            while True:
+                try:
+                    start, end = ranges.get_nowait()
+                except queue.Empty:
+                    break
+
+                self.crawl_range(start, end, results)
+        except Exception as e:
+            results.put(e)
+        finally:
+            results.put(None)
+
+    def crawl(self, since, until, ranges_per_token=4):
+        ranges = queue.Queue()
+        for start, end in self.split(since, until,
+                                     len(self.pool) * ranges_per_token):
+            if self.checkpoints.load(start, end) < end:
+                ranges.put((start, end))
+
+        results = queue.Queue(maxsize=len(self.pool) * 2)
+
+        threads = [threading.Thread(target=self.work, args=(ranges, results),
+                                    daemon=True)
+                   for _ in range(len(self.pool))]
+        for thread in threads:
+            thread.start()
+
+        error = None
+        running = len(threads)
+
+        while running > 0:
+            result = results.get()
+
+            if result is None:
+                running -= 1
+            elif isinstance(result, Exception):
+                error = result
+                # stop handing out ranges so the other workers finish
+                while not ranges.empty():
+                    try:
+                        ranges.get_nowait()
+                    except queue.Empty:
+                        break
+            else:
+                start, end, users, next_since = result
+                self.database.insert_many_users_with_ids(
+                    [(user['id'], user['login']) for user in users])
+                self.database.commit()
+                self.checkpoints.save(start, end, next_since)
+
+                print('Users', start, '-', end, '->', next_since)
+
+        if error is not None:
+            raise error
+
+
 class Geography:
-    def __init__(self):
-        self.api_key = settings.GOOGLE_API_KEY
-        self.geolocator = GoogleV3(self.api_key)
+    def __init__(self, min_confidence=0.75):
+        from gazetteer import Gazetteer
+
+        self.gazetteer = Gazetteer()
+        self.min_confidence = min_confidence
+
+        self.geolocator = None
+        self.geocode = get_memory().cache(self.geocode)
+
+    def local_geocode(self, text):
+        place = self.gazetteer.lookup(text)
+        if place is None or place.confidence < self.min_confidence:
+            return None
+        return place
 
-        self.geocode = memory.cache(self.geocode)
+    def locate(self, text):
+        place = self.local_geocode(text)
+        if place is not None:
+            return place
+        return self.geocode(text)
 
     def geocode(self, text):
+        import geopy.exc
+
+        if self.geolocator is None:
+            from geopy.geocoders import GoogleV3
+
+            import settings
+
+            self.geolocator = GoogleV3(settings.GOOGLE_API_KEY)
+
         try:
             result = self.geolocator.geocode(text)
         except geopy.exc.GeocoderQuotaExceeded:
@@ -119,10 +445,14 @@ class Geography:
 
 class Genderize:
     def __init__(self):
+        import settings
+
         self.api_key = settings.GENDERIZE_API_KEY
-        self.guess = memory.cache(self.guess)
+        self.guess = get_memory().cache(self.guess)
 
     def guess(self, name):
+        import requests
+
         if name == "<script>alert('test')</script>":
             return '?', None
 
@@ -147,150 +477,202 @@ class Genderize:
         return code, probability
 
 
-class Scraper:
-    def __init__(self):
-        self.github = GitHub()
-        self.genderize = Genderize()
-        self.geography = Geography()
+SEEN_ERROR_RATE = 0.001
 
-        self.database = Database()
-        self.events = Events()
 
-    def scrape_user_details(self, start_from):
-        i = 0
+class SeenSet:
+    def __init__(self, path, get_existing, iterate_existing,
+                 error_rate=SEEN_ERROR_RATE):
+        from bloom import ScalableBloomFilter
 
-        for event in self.events.iterate(start_from=start_from):
-            try:
-                actor = event['actor']
-                login = actor['login']
-            except TypeError:
-                login = event['actor']
-            except KeyError:
-                continue
+        self.path = Path(path)
+        self.get_existing = get_existing
 
-            if login is None:
-                continue
+        if self.path.exists():
+            self.bloom = ScalableBloomFilter.load(self.path)
+        else:
+            print('Warming seen set:', self.path)
+            self.bloom = ScalableBloomFilter(error_rate)
+            for item in iterate_existing():
+                self.bloom.add(item)
+            self.save()
 
-            if 'actor_attributes' not in event:
-                continue
+    def unseen(self, items):
+        items = set(items)
 
-            github_user = event['actor_attributes']
-            github_user.setdefault('id', None)
-            github_user.setdefault('name', None)
-            github_user.setdefault('hireable', None)
-            github_user.setdefault('company', None)
-            github_user.setdefault('blog', None)
-            github_user.setdefault('location', None)
-            github_user.setdefault('bio', None)
+        # a bloom filter hit may be a false positive, so check those exactly
+        hits = [item for item in items if item in self.bloom]
+        if hits:
+            items -= self.get_existing(hits)
 
-            fields = {
-                'id': github_user['id'],
-                'hireable': github_user['hireable'],
-                'deleted': False,
-            }
+        return items
 
-            for field in ['name', 'company', 'blog', 'location', 'bio']:
-                if github_user[field] is None:
-                    fields[field] = None
-                else:
-                    fields[field] = github_user[field].strip()
+    def add(self, items):
+        for item in items:
+            self.bloom.add(item)
 
-            self.database.update_user(login, fields)
+    def save(self):
+        self.bloom.save(self.path)
 
-            i += 1
 
-            if i > 100:
-                self.database.commit()
-                i = 0
+class Scraper:
+    def __init__(self):
+        self.github = GitHub()
+        self.genderize = Genderize()
+        self.geography = Geography()
 
-        self.database.commit()
+        self.database = Database()
+        self.events = Events()
 
-    def scrape_user_logins(self, start_from):
-        logins = set()
+    def scrape_all_users(self, since, until):
+        crawler = UserCrawler(self.database)
+        crawler.crawl(since, until)
 
-        for event in self.events.iterate(start_from=start_from):
-            try:
-                actor = event['actor']
-                login = actor['login']
-            except TypeError:
-                login = event['actor']
-            except KeyError:
-                continue
+    def scrape_follow_graph(self, seed):
+        from graph import FollowCrawler
 
-            if login is None:
-                continue
+        crawler = FollowCrawler(self.github)
+        crawler.crawl(seed)
 
-            logins.add(login)
+    def scrape_user_details(self, start_from):
+        with BackgroundWriter() as writer:
+            for event in self.events.iterate(start_from=start_from):
+                try:
+                    actor = event['actor']
+                    login = actor['login']
+                except TypeError:
+                    login = event['actor']
+                except KeyError:
+                    continue
+
+                if login is None:
+                    continue
+
+                if 'actor_attributes' not in event:
+                    continue
+
+                github_user = event['actor_attributes']
+                github_user.setdefault('id', None)
+                github_user.setdefault('name', None)
+                github_user.setdefault('hireable', None)
+                github_user.setdefault('company', None)
+                github_user.setdefault('blog', None)
+                github_user.setdefault('location', None)
+                github_user.setdefault('bio', None)
+
+                fields = {
+                    'id': github_user['id'],
+                    'hireable': github_user['hireable'],
+                    'deleted': False,
+                }
+
+                for field in ['name', 'company', 'blog', 'location', 'bio']:
+                    if github_user[field] is None:
+                        fields[field] = None
+                    else:
+                        fields[field] = github_user[field].strip()
+
+                writer.submit('update_user', login, fields)
+
+    def insert_new_users(self, writer, seen, logins):
+        logins = seen.unseen(logins)
+        writer.submit('insert_many_users', list(logins))
+        writer.flush()
+        seen.add(logins)
 
-            if len(logins) >= 100000:
-                self.database.insert_many_users(logins)
-                self.database.commit()
-                logins = set()
+    def scrape_user_logins(self, start_from):
+        seen = SeenSet('cache/scrape/seen_logins.bloom',
+                       self.database.get_existing_logins,
+                       self.database.iterate_logins)
 
-        self.database.insert_many_users(logins)
-        self.database.commit()
+        with BackgroundWriter() as writer:
+            logins = set()
 
-    def scrape_user_activity(self, start_from):
-        first_active = {}
-        last_active = {}
+            for event in self.events.iterate(start_from=start_from):
+                try:
+                    actor = event['actor']
+                    login = actor['login']
+                except TypeError:
+                    login = event['actor']
+                except KeyError:
+                    continue
 
-        for event in self.events.iterate(start_from=start_from):
-            try:
-                actor = event['actor']
-                login = actor['login']
-            except TypeError:
-                login = event['actor']
-            except KeyError:
-                continue
+                if login is None:
+                    continue
 
-            if login is None:
-                continue
+                logins.add(login)
 
-            active_date = event['created_at']
+                if len(logins) >= 100000:
+                    self.insert_new_users(writer, seen, logins)
+                    logins = set()
 
-            if login not in first_active:
-                first_active[login] = active_date
-            last_active[login] = active_date
+            self.insert_new_users(writer, seen, logins)
 
-            if len(last_active) >= 100000:
-                self.database.update_user_activity(first_active, last_active)
-                first_active = {}
-                last_active = {}
+        seen.save()
 
-        self.database.update_user_activity(first_active, last_active)
+    def scrape_user_activity(self, start_from):
+        with BackgroundWriter() as writer:
+            first_active = {}
+            last_active = {}
 
-    def scrape_user_events(self, start_from):
-        i = 0
+            for event in self.events.iterate(start_from=start_from):
+                try:
+                    actor = event['actor']
+                    login = actor['login']
+                except TypeError:
+                    login = event['actor']
+                except KeyError:
+                    continue
 
-        for event in self.events.iterate(start_from=start_from):
-            try:
-                actor = event['actor']
-                login = actor['login']
-            except TypeError:
-                login = event['actor']
-            except KeyError:
-                continue
+                if login is None:
+                    continue
 
-            if login is None:
-                continue
+                active_date = event['created_at']
 
-            self.database.add_user_event(login, event['type'])
+                if login not in first_active:
+                    first_active[login] = active_date
+                last_active[login] = active_date
 
-            i += 1
-            if i >= 5000:
-                self.database.commit()
-                i = 0
+                if len(last_active) >= 100000:
+                    writer.submit('update_user_activity', first_active,
+                                  last_active)
+                    writer.flush()
+                    first_active = {}
+                    last_active = {}
 
-        self.database.commit()
+            writer.submit('update_user_activity', first_active, last_active)
 
-    def scrape_locations(self):
+    def scrape_user_events(self, start_from):
+        with BackgroundWriter() as writer:
+            for event in self.events.iterate(start_from=start_from):
+                try:
+                    actor = event['actor']
+                    login = actor['login']
+                except TypeError:
+                    login = event['actor']
+                except KeyError:
+                    continue
+
+                if login is None:
+                    continue
+
+                writer.submit('add_user_event', login, event['type'])
+
+    def scrape_locations(self, offline=False):
         locations = {}
 
         users = self.database.get_users_without_location()
         len_users = len(users)
 
         for i, (login, location_str) in enumerate(users):
-            location = self.geography.geocode(location_str)
+            if offline:
+                # leave anything uncertain for a later run with the API
+                location = self.geography.local_geocode(location_str)
+                if location is None:
+                    continue
+            else:
+                location = self.geography.locate(location_str)
+
             if location is None:
                 print(login, location_str, '->', '?')
                 locations[login] = (None, None, '?')
@@ -348,50 +730,53 @@ class Scraper:
 
         print('Finished.')
 
+    def insert_new_repositories(self, writer, seen, names):
+        names = seen.unseen(names)
+        writer.submit('insert_many_repositories', list(names))
+        writer.flush()
+        seen.add(names)
+
     def scrape_project_names(self, start_from):
-        names = set()
+        seen = SeenSet('cache/scrape/seen_repositories.bloom',
+                       self.database.get_existing_repositories,
+                       self.database.iterate_repositories)
 
-        for event in self.events.iterate(start_from=start_from):
-            try:
-                repository = event['repository']
-            except KeyError:
-                continue
+        with BackgroundWriter() as writer:
+            names = set()
 
-            names.add((repository['owner'], repository['name']))
+            for event in self.events.iterate(start_from=start_from):
+                try:
+                    repository = event['repository']
+                except KeyError:
+                    continue
 
-            if len(names) >= 100000:
-                self.database.insert_many_repositories(names)
-                self.database.commit()
-                names = set()
+                names.add((repository['owner'], repository['name']))
 
-        self.database.insert_many_repositories(names)
-        self.database.commit()
+                if len(names) >= 100000:
+                    self.insert_new_repositories(writer, seen, names)
+                    names = set()
 
-    def scrape_project_details(self, start_from):
-        i = 0
+            self.insert_new_repositories(writer, seen, names)
 
-        for event in self.events.iterate(start_from=start_from):
-            try:
-                repository = event['repository']
-            except KeyError:
-                continue
-
-            fields = {
-                'is_fork': repository['fork']
-            }
+        seen.save()
 
-            for field in ['language', 'stargazers', 'has_downloads', 'has_issues', 'watchers', 'open_issues', 'size', 'has_wiki', 'forks']:
-                fields[field] = repository.get(field, None)
+    def scrape_project_details(self, start_from):
+        with BackgroundWriter() as writer:
+            for event in self.events.iterate(start_from=start_from):
+                try:
+                    repository = event['repository']
+                except KeyError:
+                    continue
 
-            self.database.update_project(repository['owner'], repository['name'], fields)
+                fields = {
+                    'is_fork': repository['fork']
+                }
 
-            i += 1
+                for field in ['language', 'stargazers', 'has_downloads', 'has_issues', 'watchers', 'open_issues', 'size', 'has_wiki', 'forks']:
+                    fields[field] = repository.get(field, None)
 
-            if i > 100:
-                self.database.commit()
-                i = 0
-
-        self.database.commit()
+                writer.submit('update_project', repository['owner'],
+                              repository['name'], fields)
 
 
 def scrape(scraper):
@@ -399,6 +784,10 @@ def scrape(scraper):
 
     if sys.argv[1] == 'user_details':
         scraper.scrape_user_details(sys.argv[2])
+    elif sys.argv[1] == 'all_users':
+        scraper.scrape_all_users(int(sys.argv[2]), int(sys.argv[3]))
+    elif sys.argv[1] == 'follow_graph':
+        scraper.scrape_follow_graph(sys.argv[2])
     elif sys.argv[1] == 'user_logins':
         scraper.scrape_user_logins(sys.argv[2])
     elif sys.argv[1] == 'user_activity':
@@ -409,6 +798,8 @@ def scrape(scraper):
         scraper.scrape_genders()
     elif sys.argv[1] == 'locations':
         scraper.scrape_locations()
+    elif sys.argv[1] == 'locations_offline':
+        scraper.scrape_locations(offline=True)
     elif sys.argv[1] == 'project_names':
         scraper.scrape_project_names(sys.argv[2])
     elif sys.argv[1] == 'project_details':
@@ -420,13 +811,19 @@ def scrape(scraper):
 
 
 if __name__ == '__main__':
+    sys.argv[1:] = profiling.parse_args(sys.argv[1:], 'scrape')
+
+    import pymysql
+    warnings.filterwarnings('ignore', category=pymysql.Warning)
+
     scraper = Scraper()
 
     finished = False
 
     while not finished:
         try:
-            scrape(scraper)
+            with profiling.stage(sys.argv[1]):
+                scrape(scraper)
         except RateLimitError as e:
             print('Rate limit error!')
             e.wait()
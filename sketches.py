@@ -0,0 +1,296 @@
+from array import array
+from collections import OrderedDict
+import hashlib
+import heapq
+import math
+import multiprocessing
+import operator
+from pathlib import Path
+import pickle
+import sys
+
+from bloom import get_hashes
+from dataset import Events
+
+
+def hash64(item):
+    digest = hashlib.blake2b(item.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
+
+
+class HyperLogLog:
+    def __init__(self, precision=14):
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    def add(self, item):
+        h = hash64(item)
+
+        index = h >> (64 - self.precision)
+        rest = h & ((1 << (64 - self.precision)) - 1)
+        rank = 64 - self.precision - rest.bit_length() + 1
+
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def count(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+
+        # linear counting is more accurate while most registers are empty
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros > 0:
+            estimate = m * math.log(m / zeros)
+
+        return int(round(estimate))
+
+
+class CountMinSketch:
+    def __init__(self, width=1 << 16, depth=4):
+        self.width = width
+        self.tables = [array('q', [0]) * width for _ in range(depth)]
+
+    def add(self, item, count=1):
+        h1, h2 = get_hashes(item)
+        for i, table in enumerate(self.tables):
+            table[(h1 + i * h2) % self.width] += count
+
+    def estimate(self, item):
+        h1, h2 = get_hashes(item)
+        return min(table[(h1 + i * h2) % self.width]
+                   for i, table in enumerate(self.tables))
+
+    def merge(self, other):
+        self.tables = [array('q', map(operator.add, table, other_table))
+                       for table, other_table in zip(self.tables, other.tables)]
+
+
+class SpaceSaving:
+    # Metwally et al: keep `capacity` counters, and when a new item arrives
+    # with none free, it takes over the smallest one. A lazy min-heap finds
+    # the smallest counter; stale entries are skipped and rebuilt away.
+
+    def __init__(self, capacity=1000):
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+        self.heap = []
+
+    def add(self, item, count=1):
+        if item in self.counts:
+            self.counts[item] += count
+        elif len(self.counts) < self.capacity:
+            self.counts[item] = count
+            self.errors[item] = 0
+        else:
+            smallest, minimum = self.pop_smallest()
+            del self.counts[smallest]
+            del self.errors[smallest]
+
+            self.counts[item] = minimum + count
+            self.errors[item] = minimum
+
+        heapq.heappush(self.heap, (self.counts[item], item))
+
+        if len(self.heap) > 4 * self.capacity:
+            self.rebuild()
+
+    def pop_smallest(self):
+        while True:
+            count, item = heapq.heappop(self.heap)
+            if self.counts.get(item) == count:
+                return item, count
+
+    def rebuild(self):
+        self.heap = [(count, item) for item, count in self.counts.items()]
+        heapq.heapify(self.heap)
+
+    @property
+    def minimum(self):
+        if len(self.counts) < self.capacity:
+            return 0
+        return min(self.counts.values())
+
+    def merge(self, other):
+        minimum = self.minimum
+        other_minimum = other.minimum
+
+        counts = {}
+        errors = {}
+        for item in set(self.counts) | set(other.counts):
+            counts[item] = self.counts.get(item, minimum) \
+                + other.counts.get(item, other_minimum)
+            errors[item] = self.errors.get(item, minimum) \
+                + other.errors.get(item, other_minimum)
+
+        top = heapq.nlargest(self.capacity, counts.items(),
+                             key=lambda pair: pair[1])
+        self.counts = dict(top)
+        self.errors = {item: errors[item] for item in self.counts}
+        self.rebuild()
+
+    def top(self, n=10):
+        # (item, count, error), where the true count is at least count - error
+        top = heapq.nlargest(n, self.counts.items(), key=lambda pair: pair[1])
+        return [(item, count, self.errors[item]) for item, count in top]
+
+
+class ArchiveSketches:
+    def __init__(self):
+        self.files = set()
+
+        self.actors = {}
+        self.repositories = {}
+
+        self.repository_events = CountMinSketch()
+        self.top_repositories = SpaceSaving(1000)
+
+        self.language_events = CountMinSketch(1 << 12)
+        self.top_languages = SpaceSaving(200)
+
+    def add(self, event):
+        month = event['created_at'][:7]
+
+        try:
+            login = event['actor']['login']
+        except TypeError:
+            login = event['actor']
+        except KeyError:
+            login = None
+
+        if login is not None:
+            if month not in self.actors:
+                self.actors[month] = HyperLogLog()
+            self.actors[month].add(login)
+
+        language = None
+        if 'repository' in event:
+            repository = event['repository']
+            name = '{}/{}'.format(repository['owner'], repository['name'])
+            language = repository.get('language')
+        elif 'repo' in event:
+            name = event['repo']['name']
+        else:
+            return
+
+        if month not in self.repositories:
+            self.repositories[month] = HyperLogLog()
+        self.repositories[month].add(name)
+
+        self.repository_events.add(name)
+        self.top_repositories.add(name)
+
+        if language is not None:
+            self.language_events.add(language)
+            self.top_languages.add(language)
+
+    def merge(self, other):
+        self.files |= other.files
+
+        for mine, theirs in [(self.actors, other.actors),
+                             (self.repositories, other.repositories)]:
+            for month, sketch in theirs.items():
+                if month in mine:
+                    mine[month].merge(sketch)
+                else:
+                    mine[month] = sketch
+
+        self.repository_events.merge(other.repository_events)
+        self.top_repositories.merge(other.top_repositories)
+        self.language_events.merge(other.language_events)
+        self.top_languages.merge(other.top_languages)
+
+    def save(self, path):
+        path = Path(path)
+        if not path.parent.exists():
+            path.parent.mkdir(parents=True)
+
+        temp = path.with_suffix('.tmp')
+        with temp.open('wb') as file:
+            pickle.dump(self, file, protocol=pickle.HIGHEST_PROTOCOL)
+        temp.replace(path)
+
+    @staticmethod
+    def load(path):
+        with Path(path).open('rb') as file:
+            return pickle.load(file)
+
+    def distinct_actors(self):
+        return OrderedDict((month, self.actors[month].count())
+                           for month in sorted(self.actors))
+
+    def distinct_repositories(self):
+        return OrderedDict((month, self.repositories[month].count())
+                           for month in sorted(self.repositories))
+
+
+def sketch_file(name):
+    sketches = ArchiveSketches()
+    sketches.files.add(name)
+
+    for event in Events().iterate(glob=name):
+        sketches.add(event)
+
+    return sketches
+
+
+def build(path='cache/sketches.pickle', processes=None):
+    try:
+        sketches = ArchiveSketches.load(path)
+    except FileNotFoundError:
+        sketches = ArchiveSketches()
+
+    # only files added to the archive since the last build
+    names = sorted(p.name for p in Events().path.glob('*.json.gz')
+                   if p.name not in sketches.files)
+
+    pool = multiprocessing.Pool(processes)
+
+    try:
+        for i, file_sketches in enumerate(pool.imap_unordered(sketch_file,
+                                                              names)):
+            sketches.merge(file_sketches)
+
+            if i % 100 == 99:
+                sketches.save(path)
+    finally:
+        pool.close()
+        pool.join()
+
+    sketches.save(path)
+    return sketches
+
+
+def report(path='cache/sketches.pickle'):
+    sketches = ArchiveSketches.load(path)
+
+    print('Distinct actors per month:')
+    for month, count in sketches.distinct_actors().items():
+        print(' ', month, count)
+
+    print('Distinct repositories per month:')
+    for month, count in sketches.distinct_repositories().items():
+        print(' ', month, count)
+
+    print('Top repositories by events:')
+    for name, count, error in sketches.top_repositories.top(20):
+        print(' ', name, count, '(±{})'.format(error))
+
+    print('Top languages by events:')
+    for name, count, error in sketches.top_languages.top(20):
+        print(' ', name, count, '(±{})'.format(error))
+
+
+if __name__ == '__main__':
+    # go through the module so that pickles name sketches.ArchiveSketches
+    # rather than __main__.ArchiveSketches, and load from anywhere
+    import sketches
+
+    if sys.argv[1] == 'build':
+        sketches.build()
+    elif sys.argv[1] == 'report':
+        sketches.report()
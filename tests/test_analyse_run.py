@@ -0,0 +1,100 @@
+from concurrent.futures.process import BrokenProcessPool
+import json
+import multiprocessing
+import os
+from pathlib import Path
+
+import pytest
+
+import analyse
+
+
+pytestmark = pytest.mark.skipif(
+    multiprocessing.get_start_method() != 'fork',
+    reason='workers need to inherit the patched module')
+
+
+def record(name, value):
+    path = Path(os.environ['ANALYSE_TEST_DIR']) / name
+    with path.open('a') as file:
+        file.write(json.dumps(value) + '\n')
+
+
+def read(tmp_path, name):
+    with (tmp_path / name).open() as file:
+        return [json.loads(line) for line in file]
+
+
+class FakeDatabase:
+    def get_table_version(self, table):
+        return 1
+
+    def close(self):
+        pass
+
+
+def load_first(database):
+    record('loads', 'first')
+    return [1, 2]
+
+
+def load_second(database):
+    record('loads', 'second')
+    return {'a': 3}
+
+
+def analyse_first(first):
+    record('analyses', ['one', first])
+    analyse.get_output('one').write_text('one')
+
+
+def analyse_both(first, second):
+    record('analyses', ['two', first, second])
+    analyse.get_output('two').write_text('two')
+
+
+def fail():
+    raise RuntimeError('worker could not start')
+
+
+@pytest.fixture
+def fake(tmp_path, monkeypatch):
+    monkeypatch.setenv('ANALYSE_TEST_DIR', str(tmp_path))
+    monkeypatch.setattr(analyse, 'Database', FakeDatabase)
+    monkeypatch.setattr(analyse, 'DATABASE_DATASETS',
+                        {'first': load_first, 'second': load_second})
+    monkeypatch.setattr(analyse, 'DATASET_TABLES',
+                        {'first': 'users', 'second': 'repositories'})
+    monkeypatch.setattr(analyse, 'ANALYSES', {
+        'one': (analyse_first, ['first']),
+        'two': (analyse_both, ['first', 'second']),
+    })
+    monkeypatch.setattr(analyse, 'get_output',
+                        lambda name: tmp_path / '{}.png'.format(name))
+
+    return analyse.ResultCache(str(tmp_path / 'cache'))
+
+
+def test_run_loads_each_dataset_once(tmp_path, fake):
+    analyse.run(['one', 'two'], processes=2, cache=fake)
+
+    assert sorted(read(tmp_path, 'loads')) == ['first', 'second']
+    assert sorted(read(tmp_path, 'analyses')) == [
+        ['one', [1, 2]],
+        ['two', [1, 2], {'a': 3}],
+    ]
+
+
+def test_run_serves_unchanged_results_from_cache(tmp_path, fake):
+    analyse.run(['one', 'two'], processes=2, cache=fake)
+    (tmp_path / 'analyses').unlink()
+
+    analyse.run(['one', 'two'], processes=2, cache=fake)
+    assert not (tmp_path / 'analyses').exists()
+
+
+def test_run_fails_when_workers_cannot_start(tmp_path, fake, monkeypatch):
+    monkeypatch.setattr(analyse, 'init_worker', lambda profiler: fail())
+
+    with pytest.raises(BrokenProcessPool):
+        analyse.run(['one'], processes=1, cache=fake)
@@ -0,0 +1,89 @@
+import threading
+
+import pytest
+
+from dataset import BackgroundWriter
+
+
+class FakeDatabase:
+    def __init__(self, fail_on=None):
+        self.fail_on = fail_on
+        self.rows = []
+        self.committed = []
+        self.closed = False
+        self.thread = None
+
+    def update_user(self, login, fields):
+        self.thread = threading.current_thread()
+        if login == self.fail_on:
+            raise ValueError(login)
+        self.rows.append((login, fields))
+
+    def commit(self):
+        self.committed.extend(self.rows)
+        self.rows = []
+
+    def close(self):
+        self.closed = True
+
+
+def test_writes_and_commits_everything():
+    database = FakeDatabase()
+
+    with BackgroundWriter(lambda: database, batch_size=100) as writer:
+        for i in range(1234):
+            writer.submit('update_user', 'user{}'.format(i), {})
+
+    assert len(database.committed) == 1234
+    assert database.rows == []
+    assert database.closed
+    assert database.thread is not threading.current_thread()
+
+
+def test_errors_reach_the_producer():
+    database = FakeDatabase(fail_on='user10')
+
+    with pytest.raises(ValueError):
+        with BackgroundWriter(lambda: database, max_pending=1) as writer:
+            for i in range(100000):
+                writer.submit('update_user', 'user{}'.format(i), {})
+
+    assert database.closed
+
+
+def test_batch_size_follows_commit_cost():
+    writer = BackgroundWriter(lambda: FakeDatabase(), batch_size=1000)
+    writer.close()
+
+    writer.adjust(write_time=1.0, commit_time=0.5)
+    assert writer.batch_size == 2000
+
+    writer.adjust(write_time=1.0, commit_time=0.001)
+    assert writer.batch_size == 1000
+
+
+def test_producer_failure_is_not_committed():
+    database = FakeDatabase()
+
+    with pytest.raises(KeyError):
+        with BackgroundWriter(lambda: database, batch_size=100) as writer:
+            for i in range(10):
+                writer.submit('update_user', 'user{}'.format(i), {})
+            writer.flush()
+            writer.submit('update_user', 'user10', {})
+            raise KeyError('fork')
+
+    assert len(database.committed) == 10
+    assert database.closed
+
+
+def test_flush_commits_without_waiting_for_the_batch():
+    database = FakeDatabase()
+    writer = BackgroundWriter(lambda: database, batch_size=1000)
+
+    writer.submit('update_user', 'user1', {})
+    writer.flush()
+    writer.submit('update_user', 'user2', {})
+    writer.abort()
+
+    assert [login for login, fields in database.committed] == ['user1']
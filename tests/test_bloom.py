@@ -0,0 +1,61 @@
+from bloom import ScalableBloomFilter
+from scrape import SeenSet
+
+
+def test_no_false_negatives():
+    bloom = ScalableBloomFilter(0.01, 1000)
+    for i in range(5000):
+        bloom.add('user{}'.format(i))
+
+    assert len(bloom.filters) > 1
+    assert all('user{}'.format(i) in bloom for i in range(5000))
+
+
+def test_false_positive_rate():
+    bloom = ScalableBloomFilter(0.01, 1000)
+    for i in range(5000):
+        bloom.add('user{}'.format(i))
+
+    false_positives = sum('other{}'.format(i) in bloom for i in range(10000))
+    assert false_positives / 10000 < 0.01
+
+
+def test_save_and_load(tmp_path):
+    bloom = ScalableBloomFilter(0.01, 100)
+    for i in range(500):
+        bloom.add(('owner', 'repo{}'.format(i)))
+
+    bloom.save(str(tmp_path / 'seen.bloom'))
+    loaded = ScalableBloomFilter.load(str(tmp_path / 'seen.bloom'))
+
+    assert len(loaded) == len(bloom)
+    assert all(('owner', 'repo{}'.format(i)) in loaded for i in range(500))
+
+
+def test_seen_set_checks_hits_exactly(tmp_path):
+    existing = {'a', 'b'}
+    checked = []
+
+    def get_existing(items):
+        checked.extend(items)
+        return existing & set(items)
+
+    seen = SeenSet(str(tmp_path / 'seen.bloom'), get_existing,
+                   lambda: iter(existing))
+
+    # pretend 'c' is a false positive
+    seen.bloom.add('c')
+
+    assert seen.unseen(['a', 'c', 'd']) == {'c', 'd'}
+    assert sorted(checked) == ['a', 'c']
+
+
+def test_seen_set_persists(tmp_path):
+    path = str(tmp_path / 'seen.bloom')
+
+    seen = SeenSet(path, lambda items: set(), lambda: iter(['a']))
+    seen.add(['b'])
+    seen.save()
+
+    seen = SeenSet(path, lambda items: set(items), lambda: iter([]))
+    assert seen.unseen(['a', 'b', 'c']) == {'c'}
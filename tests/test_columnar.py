@@ -0,0 +1,69 @@
+from decimal import Decimal
+import math
+
+import pytest
+
+from columnar import Table, export
+
+
+USERS = [
+    (1, 'alice', 'GitHub', 'GB', Decimal('51.5'), Decimal('-0.12'), 1, 'f',
+     Decimal('0.98'), 0),
+    (2, 'bob', None, 'US', None, None, None, 'm', Decimal('0.99'), 0),
+    (3, 'carol', 'GitHub', 'GB', Decimal('53.4'), Decimal('-2.24'), 0, None,
+     None, 1),
+]
+
+
+class FakeDatabase:
+    def __init__(self, rows):
+        self.rows = rows
+        self.queries = []
+
+    def iterate_rows(self, table, columns):
+        self.queries.append((table, columns))
+        return iter(self.rows)
+
+
+@pytest.fixture
+def users(tmp_path):
+    pytest.importorskip('numpy')
+
+    database = FakeDatabase(USERS)
+    export(database, 'users', str(tmp_path / 'exports'))
+    assert database.queries[0][1][:3] == ['id', 'login', 'company']
+
+    return Table('users', str(tmp_path / 'exports'),
+                 str(tmp_path / 'columns'))
+
+
+def test_numeric_columns(users):
+    import numpy as np
+
+    assert len(users) == 3
+    assert isinstance(users['id'], np.memmap)
+    assert users['id'].tolist() == [1, 2, 3]
+    assert users['hireable'].tolist() == [1, -1, 0]
+    assert users['location_latitude'][0] == 51.5
+    assert math.isnan(users['location_latitude'][1])
+
+
+def test_string_columns(users):
+    assert users['company'].tolist() == [0, -1, 0]
+    assert users.dictionary('location_country') == ['GB', 'US']
+    assert users.decode('gender').tolist() == ['f', 'm', None]
+
+
+def test_distribution(users):
+    assert users.distribution('location_country') == {'GB': 2, 'US': 1}
+    assert users.distribution('company') == {'GitHub': 2}
+    assert users.distribution('location_country',
+                              users['deleted'] == 0) == {'GB': 1, 'US': 1}
+
+
+def test_reexport_is_unpacked_again(tmp_path, users):
+    export(FakeDatabase(USERS[:1]), 'users', str(tmp_path / 'exports'))
+
+    table = Table('users', str(tmp_path / 'exports'),
+                  str(tmp_path / 'columns'))
+    assert len(table) == 1
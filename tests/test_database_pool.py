@@ -0,0 +1,142 @@
+import threading
+
+import pytest
+
+from dataset import ConnectionPool, Database, build_update_sql
+
+
+class FakeCursor:
+    def __init__(self, connection):
+        self.connection = connection
+        self.closed = False
+
+    def execute(self, sql, args=None):
+        self.connection.statements.append((sql, args))
+
+    def fetchone(self):
+        return (len(self.connection.statements),)
+
+    def close(self):
+        self.closed = True
+
+
+class FakeConnection:
+    def __init__(self):
+        self.statements = []
+        self.commits = 0
+        self.rollbacks = 0
+        self.pings = 0
+        self.closed = False
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def ping(self, reconnect=False):
+        self.pings += 1
+
+    def close(self):
+        self.closed = True
+
+
+def test_threads_get_their_own_connections():
+    pool = ConnectionPool(size=4, connect=FakeConnection)
+    database = Database(pool)
+
+    connections = []
+    barrier = threading.Barrier(4)
+
+    def work():
+        with database.session():
+            database.update_user('a', {'name': 'A'})
+            database.commit()
+            barrier.wait()
+            connections.append(database.connection)
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(set(map(id, connections))) == 4
+    assert all(c.commits == 1 for c in connections)
+
+
+def test_connections_are_reused():
+    pool = ConnectionPool(size=1, connect=FakeConnection)
+    database = Database(pool)
+
+    with database.session():
+        first = database.connection
+    with database.session():
+        second = database.connection
+
+    assert first is second
+    assert first.rollbacks == 2
+    assert len(pool.connections) == 1
+
+
+def test_idle_connections_are_checked():
+    pool = ConnectionPool(size=1, connect=FakeConnection, max_idle_time=-1)
+
+    connection = pool.acquire()
+    pool.release(connection)
+    assert pool.acquire() is connection
+    assert connection.pings == 1
+
+
+def test_close_closes_owned_pool():
+    pool = ConnectionPool(size=2, connect=FakeConnection)
+    database = Database(pool)
+    database.owns_pool = True
+
+    connection = database.connection
+    database.close()
+
+    assert connection.closed
+
+
+def test_failed_connect_frees_slot():
+    def fail():
+        raise RuntimeError()
+
+    pool = ConnectionPool(size=1, connect=fail)
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            pool.acquire()
+
+
+def test_build_update_sql():
+    sql = build_update_sql('repositories', ('language', 'size'),
+                           ('owner', 'name'))
+    assert sql == 'UPDATE repositories SET language = %s, size = %s ' \
+        'WHERE owner = %s AND name = %s'
+
+
+def test_threads_that_exit_return_their_connections():
+    pool = ConnectionPool(size=2, connect=FakeConnection)
+    database = Database(pool)
+    barrier = threading.Barrier(2)
+
+    def work():
+        database.has_user('a')
+        barrier.wait()
+
+    # more threads than connections, none of them releasing explicitly
+    for _ in range(3):
+        threads = [threading.Thread(target=work) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    assert pool.slots.acquire(timeout=2)
+    assert pool.slots.acquire(timeout=2)
+    assert len(pool.connections) == 2
+    assert sum(c.rollbacks for c in pool.connections) == 6
@@ -0,0 +1,51 @@
+import pytest
+
+from gazetteer import Gazetteer, normalise
+
+
+@pytest.fixture(scope='module')
+def gazetteer():
+    return Gazetteer()
+
+
+def test_normalise():
+    assert normalise('São Paulo - SP') == ('sao', 'paulo', 'sp')
+    assert normalise('U.S.A.') == ('u', 's', 'a')
+
+
+@pytest.mark.parametrize('text, name, code', [
+    ('London, UK', 'London', 'GB'),
+    ('SF', 'San Francisco', 'US'),
+    ('Deutschland', 'Germany', 'DE'),
+    ('San Francisco CA', 'San Francisco', 'US'),
+    ('New York, NY', 'New York City', 'US'),
+    ('Cambridge, MA', 'Cambridge', 'US'),
+    ('Cambridge, UK', 'Cambridge', 'GB'),
+    ('Based in London', 'London', 'GB'),
+    ('München', 'Munich', 'DE'),
+    ('Greater Seattle Area', 'Seattle', 'US'),
+    ('Portland, OR', 'Portland', 'US'),
+    ('Seattle, Washington State', 'Seattle', 'US'),
+    ('New Orleans, LA', 'New Orleans', 'US'),
+    ('Edinburgh, Scotland', 'Edinburgh', 'GB'),
+])
+def test_confident_matches(gazetteer, text, name, code):
+    place = gazetteer.lookup(text)
+    assert (place.name, place.country_code) == (name, code)
+    assert place.confidence == 1
+
+
+@pytest.mark.parametrize('text', ['Georgia', 'Paris, TX', 'Springfield, IL',
+                                  'Portland, ME', 'Munich, NRW'])
+def test_uncertain_matches(gazetteer, text):
+    assert gazetteer.lookup(text).confidence < 0.75
+
+
+def test_unknown_location(gazetteer):
+    assert gazetteer.lookup('Somewhere, Nowhere') is None
+
+
+def test_raw_has_country_component(gazetteer):
+    component = gazetteer.lookup('Tokyo').raw['address_components'][0]
+    assert component['short_name'] == 'JP'
+    assert component['long_name'] == 'Japan'
@@ -0,0 +1,113 @@
+import pytest
+
+from graph import FollowCrawler, FollowGraph, build
+from scrape import GitHub, RateLimitError
+
+
+FOLLOWING = {
+    'a': ['b', 'c'],
+    'b': ['c'],
+    'c': ['a', 'd'],
+    'd': [],
+}
+
+
+class FakeGitHub:
+    def __init__(self, fail_on=None):
+        self.fail_on = fail_on
+        self.requests = []
+
+    def get_following_users(self, login):
+        self.requests.append(login)
+        for i, other in enumerate(FOLLOWING[login]):
+            if login == self.fail_on and i == 1:
+                raise RateLimitError(0)
+            yield {'login': other}
+
+
+def read_edges(crawler):
+    from array import array
+    edges = array('i')
+    with crawler.edges_path.open('rb') as file:
+        edges.frombytes(file.read())
+    return list(zip(edges[::2], edges[1::2]))
+
+
+def test_crawl_is_breadth_first(tmp_path):
+    crawler = FollowCrawler(FakeGitHub(), str(tmp_path))
+    crawler.crawl('a')
+
+    assert crawler.logins == ['a', 'b', 'c', 'd']
+    assert read_edges(crawler) == [(0, 1), (0, 2), (1, 2), (2, 0), (2, 3)]
+
+
+def test_crawl_resumes_after_interruption(tmp_path):
+    crawler = FollowCrawler(FakeGitHub(fail_on='c'), str(tmp_path))
+    with pytest.raises(RateLimitError):
+        crawler.crawl('a')
+
+    github = FakeGitHub()
+    crawler = FollowCrawler(github, str(tmp_path))
+    crawler.crawl('a')
+
+    assert github.requests == ['c', 'd']
+    assert crawler.logins == ['a', 'b', 'c', 'd']
+    assert read_edges(crawler) == [(0, 1), (0, 2), (1, 2), (2, 0), (2, 3)]
+
+
+class FakeResponse:
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self.body = body
+        self.links = {}
+
+    def json(self):
+        return self.body
+
+
+class MissingUserGitHub(GitHub):
+    # 'b' has been renamed since 'a' followed them
+    def get(self, url, params=None):
+        login = url.split('/')[-2]
+        if login == 'b':
+            return FakeResponse(404, {'message': 'Not Found'})
+        return FakeResponse(200, [{'login': other}
+                                  for other in FOLLOWING[login]])
+
+
+def test_crawl_skips_missing_users(tmp_path):
+    crawler = FollowCrawler(MissingUserGitHub('id', 'secret', cache=object()),
+                            str(tmp_path))
+    crawler.crawl('a')
+
+    assert crawler.state['head'] == 4
+    assert crawler.logins == ['a', 'b', 'c', 'd']
+    assert read_edges(crawler) == [(0, 1), (0, 2), (2, 0), (2, 3)]
+
+
+@pytest.fixture
+def graph(tmp_path):
+    pytest.importorskip('numpy')
+
+    FollowCrawler(FakeGitHub(), str(tmp_path)).crawl('a')
+    build(str(tmp_path))
+    return FollowGraph(str(tmp_path))
+
+
+def test_degrees(graph):
+    assert list(graph.out_degree) == [2, 1, 2, 0]
+    assert list(graph.in_degree) == [1, 1, 2, 1]
+    assert list(graph.following(2)) == [0, 3]
+
+
+def test_pagerank_sums_to_one(graph):
+    rank = graph.pagerank()
+    assert rank.sum() == pytest.approx(1)
+    assert rank.argmax() == 2
+
+
+def test_country_matrix(graph):
+    codes, matrix = graph.country_matrix({'a': 'GB', 'b': 'GB', 'c': 'US'})
+
+    assert codes == ['GB', 'US']
+    assert matrix.tolist() == [[1, 2], [1, 0]]
@@ -0,0 +1,78 @@
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import json
+import threading
+
+import pytest
+
+from scrape import GitHub, HTTPCache
+
+
+def test_get_returns_stored_entry(tmp_path):
+    cache = HTTPCache(str(tmp_path / 'http.sqlite'))
+    cache.put('http://x/users/a', '"abc"', None, {'next': {'url': 'n'}},
+              b'{}')
+
+    entry = cache.get('http://x/users/a')
+    assert entry['etag'] == '"abc"'
+    assert entry['links'] == {'next': {'url': 'n'}}
+    assert entry['body'] == b'{}'
+
+    assert cache.get('http://x/users/b') is None
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = HTTPCache(str(tmp_path / 'http.sqlite'), max_size=25)
+
+    cache.put('a', '"a"', None, {}, b'x' * 10)
+    cache.put('b', '"b"', None, {}, b'x' * 10)
+    cache.get('a')
+    cache.put('c', '"c"', None, {}, b'x' * 10)
+
+    assert cache.get('a') is not None
+    assert cache.get('b') is None
+    assert cache.get('c') is not None
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    requests = []
+
+    def do_GET(self):
+        self.requests.append(dict(self.headers))
+
+        if self.headers.get('If-None-Match') == '"v1"':
+            self.send_response(304)
+            body = b''
+        else:
+            self.send_response(200)
+            body = json.dumps({'login': 'octocat'}).encode('utf-8')
+            self.send_header('ETag', '"v1"')
+
+        self.send_header('X-RateLimit-Remaining', '10')
+        self.send_header('X-RateLimit-Reset', '0')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_not_modified_is_served_from_cache(tmp_path):
+    pytest.importorskip('requests')
+
+    server = HTTPServer(('127.0.0.1', 0), StubHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    try:
+        url = 'http://127.0.0.1:{}/users/octocat'.format(server.server_port)
+        github = GitHub('id', 'secret', HTTPCache(str(tmp_path / 'h.sqlite')))
+
+        first = github.get(url).json()
+        second = github.get(url).json()
+    finally:
+        server.shutdown()
+
+    assert first == second == {'login': 'octocat'}
+    assert 'If-None-Match' not in StubHandler.requests[0]
+    assert StubHandler.requests[1]['If-None-Match'] == '"v1"'
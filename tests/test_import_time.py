@@ -0,0 +1,39 @@
+import json
+from pathlib import Path
+import subprocess
+import sys
+
+import pytest
+
+
+ROOT = Path(__file__).resolve().parent.parent
+
+HEAVY_MODULES = ['matplotlib', 'numpy', 'PIL', 'joblib', 'pymysql',
+                 'requests', 'geopy', 'iso3166', 'settings']
+
+SCRIPT = """
+import json
+import sys
+import {0}
+print(json.dumps(sorted(sys.modules)))
+"""
+
+
+# Wall-clock import time depends too much on the machine to assert on, so
+# this checks what makes imports slow instead: which modules get loaded.
+# 'python -X importtime -c "import scrape"' shows the timings.
+def import_module(name):
+    result = subprocess.run(
+        [sys.executable, '-c', SCRIPT.format(name)],
+        cwd=str(ROOT), stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        universal_newlines=True, check=True)
+
+    return json.loads(result.stdout)
+
+
+@pytest.mark.parametrize('name', ['analyse', 'dataset', 'scrape'])
+def test_no_heavy_imports(name):
+    modules = import_module(name)
+
+    loaded = [module for module in HEAVY_MODULES if module in modules]
+    assert loaded == []
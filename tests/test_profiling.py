@@ -0,0 +1,61 @@
+import pstats
+import time
+
+import pytest
+
+import profiling
+
+
+@pytest.fixture(autouse=True)
+def reset_active():
+    yield
+    profiling.active = None
+
+
+def busy(seconds):
+    end = time.time() + seconds
+    while time.time() < end:
+        pass
+
+
+def test_parse_args_strips_options(tmp_path):
+    path = str(tmp_path / 'profile')
+    argv = profiling.parse_args(
+        ['user_logins', '--profile=' + path, '--profile-memory=commit',
+         '2012-01-01'], 'scrape')
+
+    assert argv == ['user_logins', '2012-01-01']
+    assert profiling.active.memory_points == {'commit'}
+
+
+def test_parse_args_without_profile():
+    assert profiling.parse_args(['genders'], 'scrape') == ['genders']
+    assert profiling.active is None
+
+
+def test_stage_writes_profiles(tmp_path):
+    profiling.active = profiling.Profiler(tmp_path, ['commit'],
+                                          interval=0.001)
+
+    with profiling.stage('genders'):
+        busy(0.05)
+        profiling.checkpoint('commit')
+        profiling.checkpoint('file')
+
+    stats = list(tmp_path.glob('genders-*.pstats'))
+    assert len(stats) == 1
+    pstats.Stats(str(stats[0]))
+
+    collapsed = list(tmp_path.glob('genders-*.collapsed'))[0].read_text()
+    assert 'test_profiling.py:busy' in collapsed
+
+    snapshots = sorted(p.name for p in tmp_path.glob('*.tracemalloc'))
+    assert len(snapshots) == 2
+    assert snapshots[0].startswith('genders-commit-1-')
+    assert snapshots[1].startswith('genders-end-1-')
+
+
+def test_checkpoint_without_profiler_does_nothing():
+    profiling.checkpoint('commit')
+    with profiling.stage('genders'):
+        pass
@@ -0,0 +1,102 @@
+import os
+import zlib
+
+import analyse
+from analyse import ResultCache
+from dataset import ConnectionPool, Database
+
+
+def write(path, size):
+    path.write_bytes(b'x' * size)
+
+
+def test_get_returns_stored_result(tmp_path):
+    cache = ResultCache(str(tmp_path / 'cache'))
+    output = tmp_path / 'output.png'
+
+    write(output, 10)
+    cache.put('growth', 'abc', output)
+    output.unlink()
+
+    assert cache.get('growth', 'abc', output)
+    assert output.read_bytes() == b'x' * 10
+
+
+def test_get_misses_other_keys(tmp_path):
+    cache = ResultCache(str(tmp_path / 'cache'))
+    output = tmp_path / 'output.png'
+
+    write(output, 10)
+    cache.put('growth', 'abc', output)
+
+    assert not cache.get('growth', 'def', output)
+    assert not cache.get('genders', 'abc', output)
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = ResultCache(str(tmp_path / 'cache'), max_size=25)
+    output = tmp_path / 'output.png'
+
+    for i, key in enumerate(['a', 'b', 'c']):
+        write(output, 10)
+        cache.put('growth', key, output)
+        entry = cache.entry('growth', key)
+        os.utime(str(entry), (i, i))
+
+    cache.evict()
+
+    assert not cache.entry('growth', 'a').exists()
+    assert cache.entry('growth', 'b').exists()
+    assert cache.entry('growth', 'c').exists()
+
+
+class ChecksumCursor:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def execute(self, sql, args=None):
+        self.sql = sql
+
+    def fetchone(self):
+        if self.sql.startswith('SELECT COUNT(*)'):
+            return (len(self.rows),)
+        return ('users', zlib.crc32(repr(self.rows).encode('utf-8')))
+
+    def close(self):
+        pass
+
+
+class ChecksumConnection:
+    def __init__(self):
+        self.rows = [('alice', None), ('bob', None)]
+
+    def cursor(self):
+        return ChecksumCursor(self.rows)
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def test_key_changes_when_rows_change_in_place():
+    connection = ChecksumConnection()
+    database = Database(ConnectionPool(size=1, connect=lambda: connection))
+
+    versions = {'country_distribution': database.get_table_version('users')}
+    before = analyse.get_cache_key('countries', versions)
+
+    # same number of rows, but a location has been filled in
+    connection.rows[0] = ('alice', 'GB')
+
+    versions = {'country_distribution': database.get_table_version('users')}
+    after = analyse.get_cache_key('countries', versions)
+
+    database.close()
+    assert before != after
+
+
+def test_missing_version_is_never_cached():
+    versions = {'country_distribution': None}
+    assert analyse.get_cache_key('countries', versions) is None
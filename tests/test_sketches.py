@@ -0,0 +1,112 @@
+from collections import Counter
+import random
+
+from sketches import (ArchiveSketches, CountMinSketch, HyperLogLog,
+                      SpaceSaving)
+
+
+def test_hyperloglog_count():
+    sketch = HyperLogLog()
+    for i in range(50000):
+        sketch.add('user{}'.format(i % 20000))
+
+    assert abs(sketch.count() - 20000) / 20000 < 0.03
+
+
+def test_hyperloglog_merge():
+    first, second, both = HyperLogLog(), HyperLogLog(), HyperLogLog()
+    for i in range(10000):
+        first.add('user{}'.format(i))
+        both.add('user{}'.format(i))
+    for i in range(5000, 15000):
+        second.add('user{}'.format(i))
+        both.add('user{}'.format(i))
+
+    first.merge(second)
+    assert first.registers == both.registers
+
+
+def test_count_min_never_underestimates():
+    sketch = CountMinSketch(256, 4)
+    counts = Counter('repo{}'.format(random.randrange(1000))
+                     for _ in range(10000))
+    for name, count in counts.items():
+        sketch.add(name, count)
+
+    assert all(sketch.estimate(name) >= count
+               for name, count in counts.items())
+
+
+def test_count_min_merge():
+    first, second = CountMinSketch(256), CountMinSketch(256)
+    first.add('repo', 3)
+    second.add('repo', 4)
+
+    first.merge(second)
+    assert first.estimate('repo') == 7
+
+
+def stream():
+    random.seed(0)
+    items = []
+    for i in range(20):
+        items += ['heavy{}'.format(i)] * (1000 - 40 * i)
+    items += ['light{}'.format(random.randrange(5000)) for _ in range(20000)]
+    random.shuffle(items)
+    return items
+
+
+def test_space_saving_finds_heavy_hitters():
+    summary = SpaceSaving(100)
+    for item in stream():
+        summary.add(item)
+
+    top = [item for item, count, error in summary.top(20)]
+    assert set(top) == {'heavy{}'.format(i) for i in range(20)}
+
+    for item, count, error in summary.top(20):
+        assert count - error <= 1000 - 40 * int(item[5:]) <= count
+
+
+def test_space_saving_merge():
+    items = stream()
+    first, second = SpaceSaving(100), SpaceSaving(100)
+    for item in items[:len(items) // 2]:
+        first.add(item)
+    for item in items[len(items) // 2:]:
+        second.add(item)
+
+    first.merge(second)
+    assert len(first.counts) == 100
+
+    top = [item for item, count, error in first.top(10)]
+    assert set(top) == {'heavy{}'.format(i) for i in range(10)}
+
+
+def test_archive_sketches(tmp_path):
+    events = [
+        {'created_at': '2012-03-01T00:00:00Z', 'actor': 'alice',
+         'repository': {'owner': 'alice', 'name': 'a', 'language': 'Python'}},
+        {'created_at': '2012-03-02T00:00:00Z', 'actor': 'bob',
+         'repository': {'owner': 'alice', 'name': 'a', 'language': 'Python'}},
+        {'created_at': '2015-01-01T00:00:00Z', 'actor': {'login': 'carol'},
+         'repo': {'name': 'carol/c'}},
+    ]
+
+    first, second = ArchiveSketches(), ArchiveSketches()
+    first.files.add('2012-03-01-0.json.gz')
+    second.files.add('2015-01-01-0.json.gz')
+    for event in events[:2]:
+        first.add(event)
+    second.add(events[2])
+
+    first.merge(second)
+    first.save(str(tmp_path / 'sketches.pickle'))
+    loaded = ArchiveSketches.load(str(tmp_path / 'sketches.pickle'))
+
+    assert loaded.files == {'2012-03-01-0.json.gz', '2015-01-01-0.json.gz'}
+    assert loaded.distinct_actors() == {'2012-03': 2, '2015-01': 1}
+    assert loaded.distinct_repositories() == {'2012-03': 1, '2015-01': 1}
+    assert loaded.repository_events.estimate('alice/a') == 2
+    assert loaded.top_repositories.top(1) == [('alice/a', 2, 0)]
+    assert loaded.top_languages.top() == [('Python', 2, 0)]
@@ -0,0 +1,65 @@
+import json
+
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('PIL')
+
+from tiles import build_grids, project, write_pyramid  # noqa: E402
+
+
+def test_project_corners():
+    x, y = project(np.array([85.06, -85.06]), np.array([-180, 179.999]), 0)
+    assert x.tolist() == [0, 255]
+    assert y.tolist() == [0, 255]
+
+
+def test_grids_keep_every_point():
+    points = [(51.5, -0.12), (51.5, -0.12), (40.7, -74.0), (-33.9, 151.2)]
+    grids = build_grids(points, max_zoom=4)
+
+    for zoom in range(5):
+        keys, counts = grids[zoom]
+        assert counts.sum() == 4
+
+    assert len(grids[0][0]) == 3
+
+
+def test_only_changed_tiles_are_rendered(tmp_path):
+    points = [(51.5, -0.12), (40.7, -74.0), (-33.9, 151.2)]
+
+    rendered = write_pyramid(points, str(tmp_path), max_zoom=2)
+    with (tmp_path / 'manifest.json').open() as file:
+        assert rendered == len(json.load(file))
+    assert (tmp_path / '0' / '0' / '0.png').exists()
+
+    assert write_pyramid(points, str(tmp_path), max_zoom=2) == 0
+
+    # another user in Sydney changes one tile per zoom
+    points.append((-33.91, 151.21))
+    assert write_pyramid(points, str(tmp_path), max_zoom=2) == 3
+
+
+def test_no_points(tmp_path):
+    assert write_pyramid([], str(tmp_path), max_zoom=2) == 0
+
+    write_pyramid([(51.5, -0.12)], str(tmp_path), max_zoom=2)
+    assert (tmp_path / '0' / '0' / '0.png').exists()
+
+    # every tile goes once there are no points left
+    write_pyramid([], str(tmp_path), max_zoom=2)
+    assert not list(tmp_path.glob('*/*/*.png'))
+
+
+def test_points_on_tile_edges_show_on_both_tiles(tmp_path):
+    from PIL import Image
+
+    # longitude 0 is the edge between tiles 0 and 1 at zoom 1
+    write_pyramid([(40.0, -0.1)], str(tmp_path), max_zoom=1)
+
+    left = np.array(Image.open(str(tmp_path / '1' / '0' / '0.png')))
+    right = np.array(Image.open(str(tmp_path / '1' / '1' / '0.png')))
+
+    rows = np.flatnonzero(left[:, -1, 3])
+    assert len(rows) == 3
+    assert np.flatnonzero(right[:, 0, 3]).tolist() == rows.tolist()
@@ -0,0 +1,94 @@
+from scrape import RangeCheckpoints, RateLimitError, TokenPool, UserCrawler
+
+
+class FakeResponse:
+    def __init__(self, data):
+        self.data = data
+
+    def json(self):
+        return self.data
+
+
+class FakeClient:
+    def __init__(self, user_ids, remaining=5000):
+        self.user_ids = user_ids
+        self.remaining = remaining
+        self.reset_time = 0
+        self.requests = 0
+
+    def get(self, url, params=None):
+        self.requests += 1
+        self.remaining -= 1
+        users = [{'id': i, 'login': 'user{}'.format(i)}
+                 for i in self.user_ids if i > params['since']]
+        return FakeResponse(users[:params['per_page']])
+
+
+class FakeDatabase:
+    def __init__(self):
+        self.users = {}
+        self.commits = 0
+
+    def insert_many_users_with_ids(self, users):
+        self.users.update(users)
+
+    def commit(self):
+        self.commits += 1
+
+
+def make_pool(clients):
+    pool = TokenPool([], cache=object())
+    pool.clients = clients
+    return pool
+
+
+def test_split_covers_whole_range():
+    ranges = UserCrawler.split(0, 1000, 3)
+    assert ranges[0][0] == 0
+    assert ranges[-1][1] == 1000
+    for (_, end), (start, _) in zip(ranges, ranges[1:]):
+        assert end == start
+
+
+def test_crawl_merges_all_ranges(tmp_path):
+    user_ids = list(range(1, 1000, 3))
+    pool = make_pool([FakeClient(user_ids), FakeClient(user_ids)])
+    database = FakeDatabase()
+    checkpoints = RangeCheckpoints(str(tmp_path))
+
+    UserCrawler(database, pool, checkpoints).crawl(0, 1000)
+
+    assert sorted(database.users) == user_ids
+    assert all(client.requests > 0 for client in pool.clients)
+
+
+def test_crawl_resumes_from_checkpoints(tmp_path):
+    user_ids = list(range(1, 1000))
+    checkpoints = RangeCheckpoints(str(tmp_path))
+    for start, end in UserCrawler.split(0, 1000, 4):
+        checkpoints.save(start, end, end)
+
+    client = FakeClient(user_ids)
+    UserCrawler(FakeDatabase(), make_pool([client]), checkpoints) \
+        .crawl(0, 1000)
+
+    assert client.requests == 0
+
+
+def test_acquire_raises_when_all_exhausted():
+    exhausted = FakeClient([], remaining=0)
+    exhausted.reset_time = 2 ** 40
+    pool = make_pool([exhausted])
+
+    try:
+        pool.acquire()
+    except RateLimitError as e:
+        assert e.reset_time == 2 ** 40
+    else:
+        assert False
+
+
+def test_acquire_prefers_largest_budget():
+    low = FakeClient([], remaining=10)
+    high = FakeClient([], remaining=4000)
+    assert make_pool([low, high]).acquire() is high
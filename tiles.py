@@ -0,0 +1,173 @@
+import hashlib
+import json
+import math
+from pathlib import Path
+
+
+TILE_SIZE = 256
+MAX_ZOOM = 8
+
+# counts are drawn on a fixed log scale, rather than relative to the
+# busiest pixel, so adding points only changes the tiles they land on
+SATURATION = 1000
+
+MAX_LATITUDE = 85.0511287798
+
+
+def project(latitudes, longitudes, zoom):
+    import numpy as np
+
+    size = TILE_SIZE * 2 ** zoom
+
+    latitudes = np.clip(latitudes, -MAX_LATITUDE, MAX_LATITUDE)
+    sin = np.sin(np.radians(latitudes))
+
+    x = (longitudes + 180) / 360 * size
+    y = (0.5 - np.log((1 + sin) / (1 - sin)) / (4 * math.pi)) * size
+
+    x = np.clip(x.astype(np.int64), 0, size - 1)
+    y = np.clip(y.astype(np.int64), 0, size - 1)
+    return x, y
+
+
+def build_grids(points, max_zoom=MAX_ZOOM):
+    import numpy as np
+
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    x, y = project(points[:, 0], points[:, 1], max_zoom)
+
+    # sparse grids of (pixel, count), each zoom aggregated from the next
+    grids = {}
+    for zoom in range(max_zoom, -1, -1):
+        size = TILE_SIZE * 2 ** zoom
+        keys, inverse = np.unique(y * size + x, return_inverse=True)
+
+        if zoom == max_zoom:
+            counts = np.bincount(inverse.ravel())
+        else:
+            counts = np.bincount(inverse.ravel(), weights=counts)
+            counts = counts.astype(np.int64)
+
+        grids[zoom] = (keys, counts)
+
+        x, y = (keys % size) // 2, (keys // size) // 2
+
+    return grids
+
+
+def split_tiles(keys, counts, zoom):
+    import numpy as np
+
+    # before any locations are geocoded there is nothing to draw
+    if len(keys) == 0:
+        return
+
+    size = TILE_SIZE * 2 ** zoom
+    tiles_per_row = 2 ** zoom
+
+    x = keys % size
+    y = keys // size
+
+    # points are drawn 3x3 pixels, so a point on a tile's edge also shows
+    # on its neighbour, and each tile gets a one pixel margin of points
+    tile_ids = []
+    for dy in (-1, 0, 1):
+        for dx in (-1, 0, 1):
+            nx, ny = x + dx, y + dy
+            inside = (nx >= 0) & (nx < size) & (ny >= 0) & (ny < size)
+            tile_ids.append((ny[inside] // TILE_SIZE) * tiles_per_row
+                            + nx[inside] // TILE_SIZE)
+
+    # keys are sorted by row, so each tile's rows are one slice of them
+    for tile_id in np.unique(np.concatenate(tile_ids)):
+        tx, ty = int(tile_id % tiles_per_row), int(tile_id // tiles_per_row)
+
+        top = max(ty * TILE_SIZE - 1, 0)
+        bottom = min((ty + 1) * TILE_SIZE + 1, size)
+        start, end = np.searchsorted(keys, [top * size, bottom * size])
+
+        left = tx * TILE_SIZE - 1
+        right = (tx + 1) * TILE_SIZE + 1
+        inside = (x[start:end] >= left) & (x[start:end] < right)
+
+        yield tx, ty, keys[start:end][inside], counts[start:end][inside]
+
+
+def checksum(keys, counts):
+    digest = hashlib.sha1(keys.tobytes())
+    digest.update(counts.tobytes())
+    return digest.hexdigest()
+
+
+def render_tile(keys, counts, zoom, tx, ty):
+    import numpy as np
+    from PIL import Image
+
+    size = TILE_SIZE * 2 ** zoom
+
+    # the tile with its one pixel margin
+    grid = np.zeros((TILE_SIZE + 2, TILE_SIZE + 2))
+    grid[keys // size - ty * TILE_SIZE + 1,
+         keys % size - tx * TILE_SIZE + 1] = counts
+
+    intensity = np.clip(np.log1p(grid) / math.log1p(SATURATION), 0, 1)
+
+    # grow each point to 3x3 pixels so single users stay visible
+    intensity = np.max([intensity[dy:dy + TILE_SIZE, dx:dx + TILE_SIZE]
+                        for dy in range(3) for dx in range(3)], axis=0)
+
+    rgba = np.zeros((TILE_SIZE, TILE_SIZE, 4), dtype=np.uint8)
+    visible = intensity > 0
+    rgba[..., 0] = 255
+    rgba[..., 1] = (255 * (1 - intensity)).astype(np.uint8)
+    rgba[..., 3] = np.where(visible, 96 + 159 * intensity, 0).astype(np.uint8)
+
+    return Image.fromarray(rgba)
+
+
+def write_pyramid(points, path='results/tiles', max_zoom=MAX_ZOOM):
+    path = Path(path)
+    manifest_path = path / 'manifest.json'
+
+    try:
+        with manifest_path.open() as file:
+            manifest = json.load(file)
+    except FileNotFoundError:
+        manifest = {}
+
+    grids = build_grids(points, max_zoom)
+
+    rendered = 0
+    current = {}
+
+    for zoom, (keys, counts) in sorted(grids.items()):
+        for tx, ty, tile_keys, tile_counts in split_tiles(keys, counts, zoom):
+            name = '{}/{}/{}'.format(zoom, tx, ty)
+            current[name] = checksum(tile_keys, tile_counts)
+
+            if manifest.get(name) == current[name]:
+                continue
+
+            tile_path = path / '{}.png'.format(name)
+            if not tile_path.parent.exists():
+                tile_path.parent.mkdir(parents=True)
+
+            render_tile(tile_keys, tile_counts, zoom, tx, ty) \
+                .save(str(tile_path))
+            rendered += 1
+
+    # tiles that no longer have any points
+    for name in set(manifest) - set(current):
+        tile_path = path / '{}.png'.format(name)
+        if tile_path.exists():
+            tile_path.unlink()
+
+    if not path.exists():
+        path.mkdir(parents=True)
+
+    with manifest_path.open('w') as file:
+        json.dump(current, file)
+
+    print('Rendered', rendered, 'of', len(current), 'tiles.')
+
+    return rendered